@@ -1,38 +1,67 @@
 import discord
 from discord import app_commands
-from services.ai_client import AIClient
+from config import LLM_STREAMING
+from services.ai_client import AIClient, AIUnavailableError
+from services.tts_prefetch import tts_prefetcher
+from services.tts_service import DEFAULT_MAX_BYTES
+from utils.answer_index import answer_index
+from utils.stream_embed import StreamingEmbed
 
 ai_client = AIClient()
 
-@app_commands.command(name="ask", description="Саркастичный и грубый ответ от RudeGPT")
-@app_commands.describe(question="Твой вопрос или сообщение")
-async def ask(interaction: discord.Interaction, question: str):
-    await interaction.response.defer()
 
-    response = await ai_client.generate(question, interaction.user.id, mode="rude")
+def _remember(interaction: discord.Interaction, message: discord.Message, response: str):
+    # Полный текст (embed режется до 4096) — для /tts_chat
+    answer_index.record(interaction.channel_id, message.id, response)
+    max_bytes = interaction.guild.filesize_limit if interaction.guild else DEFAULT_MAX_BYTES
+    tts_prefetcher.schedule(interaction.guild_id, interaction.channel_id, response, max_bytes)
+
+
+async def _answer(interaction: discord.Interaction, question: str, mode: str, title: str, color: int):
+    footer = f"Запрошено: {interaction.user.display_name}"
+
+    if LLM_STREAMING:
+        # Ответ дописывается в embed по мере генерации
+        stream = StreamingEmbed(interaction, title=title, color=color, footer=footer)
+        try:
+            response = await ai_client.generate(question, interaction.user.id, mode=mode,
+                                                on_partial=stream.update, guild_id=interaction.guild_id)
+        except AIUnavailableError as e:
+            # Ошибку показываем, но не индексируем для /tts_chat и не озвучиваем заранее
+            await stream.finish(str(e))
+            return
+        message = await stream.finish(response)
+        _remember(interaction, message, response)
+        return
+
+    try:
+        response = await ai_client.generate(question, interaction.user.id, mode=mode, guild_id=interaction.guild_id)
+    except AIUnavailableError as e:
+        response, answered = str(e), False
+    else:
+        answered = True
 
     embed = discord.Embed(
-        title="😈 RudeGPT отвечает",
+        title=title,
         description=response[:4096],  # Discord limit
-        color=0xe74c3c
+        color=color
     )
-    embed.set_footer(text=f"Запрошено: {interaction.user.display_name}")
+    embed.set_footer(text=footer)
 
-    await interaction.followup.send(embed=embed)
+    message = await interaction.followup.send(embed=embed, wait=True)
+    if answered:
+        _remember(interaction, message, response)
 
 
-@app_commands.command(name="ask_helpful", description="Подробный и полезный ответ от AI")
+@app_commands.command(name="ask", description="Саркастичный и грубый ответ от RudeGPT")
 @app_commands.describe(question="Твой вопрос или сообщение")
-async def ask_helpful(interaction: discord.Interaction, question: str):
+async def ask(interaction: discord.Interaction, question: str):
     await interaction.response.defer()
+    await _answer(interaction, question, mode="rude", title="😈 RudeGPT отвечает", color=0xe74c3c)
 
-    response = await ai_client.generate(question, interaction.user.id, mode="helpful")
-
-    embed = discord.Embed(
-        title="🤓 Полезный AI отвечает",
-        description=response[:4096],
-        color=0x2ecc71
-    )
-    embed.set_footer(text=f"Запрошено: {interaction.user.display_name}")
 
-    await interaction.followup.send(embed=embed)
\ No newline at end of file
+@app_commands.command(name="ask_helpful", description="Подробный и полезный ответ от AI")
+@app_commands.describe(question="Твой вопрос или сообщение")
+async def ask_helpful(interaction: discord.Interaction, question: str):
+    await interaction.response.defer()
+    await _answer(interaction, question, mode="helpful", title="🤓 Полезный AI отвечает", color=0x2ecc71)
\ No newline at end of file
@@ -0,0 +1,53 @@
+import discord
+from discord import app_commands
+from services.ai_client import AIClient
+from services.conversation import ConversationManager
+
+ai_client = AIClient()
+conversations = ConversationManager(ai_client)
+
+
+@app_commands.command(name="chat", description="Режим беседы в этом канале: бот отвечает на все сообщения")
+@app_commands.describe(mode="Включить или выключить")
+@app_commands.choices(mode=[
+    app_commands.Choice(name="Включить", value="on"),
+    app_commands.Choice(name="Выключить", value="off"),
+    app_commands.Choice(name="Забыть историю", value="reset"),
+])
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_guild=True)
+async def chat(interaction: discord.Interaction, mode: str):
+    channel_id = interaction.channel_id
+    if mode == "on":
+        conversations.enabled.add(channel_id)
+        text = "💬 Режим беседы включён. Пиши сообщения — я помню контекст."
+    elif mode == "off":
+        conversations.enabled.discard(channel_id)
+        conversations.reset(channel_id)
+        text = "🔇 Режим беседы выключен."
+    else:
+        conversations.reset(channel_id)
+        text = "🧹 История беседы очищена."
+    await interaction.response.send_message(text)
+
+
+async def handle_message(message: discord.Message):
+    """Ответ на обычное сообщение в канале с включённым режимом беседы."""
+    if message.author.bot or not message.content or message.channel.id not in conversations.enabled:
+        return
+
+    conv = conversations.get(message.channel.id)
+    conv.add("user", f"{message.author.display_name}: {message.content}")
+    guild_id = message.guild.id if message.guild else None
+
+    async with message.channel.typing():
+        reply = await ai_client.chat(conv.messages(), message.author.id, guild_id)
+
+    if not reply:
+        await message.reply("Временная ошибка AI. Попробуй позже.", mention_author=False)
+        return
+
+    conv.add("assistant", reply)
+    for start in range(0, len(reply), 2000):
+        await message.channel.send(reply[start:start + 2000])
+    conversations.maybe_summarize(conv, message.author.id, guild_id)
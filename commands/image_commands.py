@@ -1,15 +1,56 @@
 import discord
 from discord import app_commands
-from services.image_generator import ImageGenerator
+from services.image_generator import ImageGenerator, ImageVariant
 from services.ai_client import AIClient
+from services.prompt_enhancer import PromptEnhancer
+from utils.image_pool import image_pool
+from core.logger import logger
+from utils.stream_embed import StreamingEmbed
+import asyncio
+import io
 import os
 
 image_gen = ImageGenerator()
 ai_client = AIClient()
+prompt_enhancer = PromptEnhancer(ai_client)
+
+
+def _source(variant: ImageVariant) -> str | bytes:
+    # Свежая картинка уже в памяти — повторно с диска её не читаем
+    return variant.data if variant.data is not None else variant.path
+
+
+async def _image_files(interaction: discord.Interaction, variants: list[ImageVariant], stem: str) -> list[discord.File]:
+    """
+    Вложения для картинок: пережатые в пуле процессов так, чтобы влезть в лимит сервера.
+    Картинки, которые не удалось уложить в лимит, пропускаются — список может оказаться пустым.
+    """
+    max_bytes = interaction.guild.filesize_limit if interaction.guild else discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+    prepared = await asyncio.gather(*(image_pool.prepare_upload(_source(variant), max_bytes) for variant in variants))
+    files = []
+    for index, (variant, result) in enumerate(zip(variants, prepared)):
+        name = f"{stem}_{index + 1}" if len(variants) > 1 else stem
+        if result:
+            data, ext = result
+            files.append(discord.File(io.BytesIO(data), filename=name + ext))
+            continue
+        # Оригинал без потерь (или Pillow не установлен / пережатие упало) — только если влезает
+        size = len(variant.data) if variant.data is not None else os.path.getsize(variant.path)
+        if size > max_bytes:
+            logger.warning(f"Image {name}: {size} байт больше лимита {max_bytes}, не отправляю")
+        elif variant.data is not None:
+            files.append(discord.File(io.BytesIO(variant.data), filename=name + ".png"))
+        else:
+            files.append(discord.File(variant.path, filename=name + ".png"))
+    return files
+
 
 @app_commands.command(name="generate_image", description="Сгенерировать изображение по описанию")
-@app_commands.describe(prompt="Подробное описание изображения")
-async def generate_image(interaction: discord.Interaction, prompt: str):
+@app_commands.describe(prompt="Подробное описание изображения",
+                       count="Сколько вариантов сгенерировать (одним запросом)",
+                       seed="Seed конкретного варианта, чтобы получить его снова")
+async def generate_image(interaction: discord.Interaction, prompt: str,
+                         count: app_commands.Range[int, 1, 4] = 1, seed: int | None = None):
     if not image_gen.available:
         await interaction.response.send_message(
             "❌ Генерация изображений отключена (нет API-ключа Stability AI)",
@@ -23,18 +64,27 @@ async def generate_image(interaction: discord.Interaction, prompt: str):
         embed=discord.Embed(title="🎨 Генерация изображения...", description=f"**Промпт:** {prompt[:100]}...", color=0x9b59b6)
     )
 
-    filepath = await image_gen.generate(prompt, interaction.user.id)
-
-    if filepath and os.path.exists(filepath):
-        with open(filepath, "rb") as f:
-            file = discord.File(f, filename="image.png")
+    variants = await image_gen.generate_variants(prompt, interaction.user.id, count=count, seed=seed)
+    variants = [variant for variant in variants or [] if variant.data is not None or os.path.exists(variant.path)]
 
+    files = await _image_files(interaction, variants, "image") if variants else []
+    if files:
         embed = discord.Embed(title="🎨 Изображение сгенерировано!", color=0x2ecc71)
-        embed.set_image(url="attachment://image.png")
-        embed.add_field(name="Промпт", value=prompt, inline=False)
+        embed.add_field(name="Промпт", value=prompt[:1024], inline=False)
+
+        # В embed — лёгкое превью (одна картинка или сетка вариантов), сами картинки — вложениями
+        preview = await image_pool.make_preview([_source(variant) for variant in variants])
+        if preview:
+            files.insert(0, discord.File(io.BytesIO(preview), filename="preview.jpg"))
+        embed.set_image(url=f"attachment://{files[0].filename}")
+
+        seeds = [f"{index + 1}: `{variant.seed}`" for index, variant in enumerate(variants)
+                 if variant.seed is not None]
+        if seeds:
+            embed.add_field(name="Seed", value=" · ".join(seeds), inline=False)
         embed.set_footer(text=f"Запросил: {interaction.user.display_name}")
 
-        await status.edit(embed=embed, attachments=[file])
+        await status.edit(embed=embed, attachments=files)
     else:
         await status.edit(
             embed=discord.Embed(
@@ -60,46 +110,39 @@ async def enhance_image(interaction: discord.Interaction, idea: str):
         embed=discord.Embed(title="✨ Улучшаю промпт...", description=f"**Идея:** {idea}", color=0x3498db)
     )
 
-    # Шаг 1: Пусть Mistral сделает крутой подробный промпт
-    enhance_prompt = f"""
-Ты — эксперт по созданию промптов для генерации изображений.
-Создай ОЧЕНЬ подробный, профессиональный промпт (100–200 слов) на английском для Stable Diffusion.
-Тема: {idea}
-
-Включи:
-- стиль (photorealistic, digital art, oil painting и т.д.)
-- освещение, композицию, цвета
-- детали фона, переднего плана
-- качество: 8k, highly detailed, masterpiece
-
-Промпт только текстом, без кавычек и объяснений.
-"""
-
-    enhanced = await ai_client.generate(enhance_prompt, interaction.user.id, mode="helpful")
-    enhanced = enhanced.strip()
+    # Шаг 1: LLM делает подробный промпт (потоком, прямо в статус)
+    stream = StreamingEmbed(interaction, title="✨ Улучшаю промпт...", color=0x3498db, message=status)
+    enhanced = await prompt_enhancer.enhance(idea, "image", interaction.user.id, interaction.guild_id,
+                                             on_partial=stream.update)
+    await stream.stop()
+    if not enhanced:
+        await status.edit(embed=discord.Embed(title="❌ AI недоступен", description="Не удалось улучшить промпт. Попробуй позже.", color=0xe74c3c))
+        return
 
-    await status.edit(
+    # Шаг 2: Генерация стартует сразу, статус обновляется параллельно с ней
+    status_edit = asyncio.create_task(status.edit(
         embed=discord.Embed(
             title="🎨 Генерация по улучшенному промпту...",
             description=f"**Идея:** {idea}\n**Улучшенный промпт:** ```{enhanced[:500]}...```",
             color=0xf39c12
         )
-    )
-
-    # Шаг 2: Генерация
-    filepath = await image_gen.generate(enhanced, interaction.user.id)
+    ))
+    variants = await image_gen.generate_variants(enhanced, interaction.user.id)
+    await asyncio.gather(status_edit, return_exceptions=True)
 
-    if filepath and os.path.exists(filepath):
-        with open(filepath, "rb") as f:
-            file = discord.File(f, filename="enhanced.png")
+    files = await _image_files(interaction, variants[:1], "enhanced") if variants else []
+    if files:
+        preview = await image_pool.make_preview([_source(variants[0])])
+        if preview:
+            files.insert(0, discord.File(io.BytesIO(preview), filename="preview.jpg"))
 
         embed = discord.Embed(title="✨ Изображение сгенерировано с улучшенным промптом!", color=0x2ecc71)
         embed.add_field(name="Твоя идея", value=idea, inline=False)
         embed.add_field(name="Улучшенный промпт", value=f"```{enhanced[:1024]}```", inline=False)
-        embed.set_image(url="attachment://enhanced.png")
+        embed.set_image(url=f"attachment://{files[0].filename}")
         embed.set_footer(text=f"Запросил: {interaction.user.display_name}")
 
-        await status.edit(embed=embed, attachments=[file])
+        await status.edit(embed=embed, attachments=files)
     else:
         await status.edit(
             embed=discord.Embed(
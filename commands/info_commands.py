@@ -3,6 +3,9 @@ from discord import app_commands
 from services.ai_client import AIClient
 from services.tts_service import TTSService
 from services.image_generator import ImageGenerator
+from utils.prompt_index import prompt_index
+from utils.cache import all_cache_stats
+from services.web_search import search_scoreboard
 # from services.video_generator import VideoGenerator  # если добавишь
 
 ai_client = AIClient()
@@ -17,6 +20,22 @@ async def status(interaction: discord.Interaction):
     embed.add_field(name="🤖 AI (локальный LLM)", value="✅ Работает" if await ai_client.test_connection() else "❌ Нет соединения", inline=False)
     embed.add_field(name="🔊 Text-to-Speech", value="✅ Доступно" if tts_service.available else "❌ Не установлен", inline=True)
     embed.add_field(name="🎨 Генерация изображений", value="✅ Доступно" if image_gen.available else "⚠️ Нет API-ключа", inline=True)
+    near = prompt_index.stats
+    embed.add_field(name="🧠 Похожие вопросы из кэша", value=f"{near['near_hits']} из {near['lookups']}", inline=True)
+    cache_lines = [
+        f"`{s['name']}`: {s['hit_rate']:.0%} попаданий ({s['hits']}/{s['misses']}), "
+        f"{s['bytes'] / 1024 / 1024:.1f}/{s['max_bytes'] / 1024 / 1024:.0f} МБ, вытеснено {s['evictions']}"
+        for s in all_cache_stats()
+    ]
+    embed.add_field(name="🗄️ Кэши", value="\n".join(cache_lines), inline=False)
+    state_icons = {"closed": "✅", "half-open": "⚠️", "open": "❌"}
+    search_lines = [
+        f"{state_icons[s['state']]} `{s['instance'].split('//')[-1]}`: "
+        f"{s['latency'] or 0:.1f} с, успехов {s['success_rate']:.0%}"
+        for s in search_scoreboard()
+    ]
+    if search_lines:
+        embed.add_field(name="🔍 Инстансы поиска", value="\n".join(search_lines), inline=False)
     # embed.add_field(name="🎬 Генерация видео", value="✅ Доступно" if video_gen.available else "⚠️ Нет ключа", inline=True)
 
     embed.set_footer(text="Все функции работают через API или локально — без облачных LLM")
@@ -33,10 +52,17 @@ async def help_cmd(interaction: discord.Interaction):
               "`/ask_helpful [вопрос]` — подробный и полезный ответ",
         inline=False
     )
+    embed.add_field(
+        name="💬 Беседа",
+        value="`/chat on|off|reset` — бот отвечает на сообщения в канале и помнит контекст",
+        inline=False
+    )
     embed.add_field(
         name="🔊 Озвучка",
         value="`/tts [текст] [preset]` — MP3-файл с голосом\n"
-              "Пресеты: normal, fast, calm",
+              "Пресеты: normal, fast, calm\n"
+              "`/tts_chat [message_id]` — озвучить ответ AI\n"
+              "`/tts_prefetch on|off` — заранее озвучивать ответы AI на сервере",
         inline=False
     )
     embed.add_field(
@@ -1,15 +1,49 @@
 import discord
 from discord import app_commands
-from services.tts_service import TTSService
+from services.tts_service import TTSService, TTSTooLargeError, DEFAULT_MAX_BYTES
 from services.ai_client import AIClient
-import os
+from services.tts_prefetch import tts_prefetcher
+from utils.answer_index import answer_index
 from core.logger import logger
 
 tts_service = TTSService()
 ai_client = AIClient()  # Если нужно для проверки или кэша, но в основном не обязателен
 
+
+def _message_text(message: discord.Message) -> str | None:
+    if message.embeds and message.embeds[0].description:
+        # Ответы от /ask и /ask_helpful приходят в embed.description
+        return message.embeds[0].description
+    # На всякий случай, если ответ в чистом тексте
+    return message.content or None
+
+
+async def _find_answer(interaction: discord.Interaction, message_id: int | None) -> str | None:
+    """Текст ответа AI: сначала из индекса в памяти, при промахе — из Discord."""
+    channel_id = interaction.channel_id
+    if message_id is not None:
+        if text := answer_index.get(channel_id, message_id):
+            return text
+        try:
+            message = await interaction.channel.fetch_message(message_id)
+        except discord.HTTPException:
+            return None
+        return _message_text(message) if message.author == interaction.client.user else None
+
+    if latest := answer_index.latest(channel_id):
+        return latest[1]
+
+    # Индекс пуст (например, после перезапуска) — ищем последний ответ бота в истории канала
+    async for message in interaction.channel.history(limit=20):
+        if message.author == interaction.client.user:  # Сообщение от бота
+            if text := _message_text(message):
+                return text
+    return None
+
+
 @app_commands.command(name="tts_chat", description="Озвучить последний ответ AI голосом")
-async def tts_chat(interaction: discord.Interaction):
+@app_commands.describe(message_id="ID конкретного ответа AI (по умолчанию — последний)")
+async def tts_chat(interaction: discord.Interaction, message_id: str | None = None):
     if not tts_service.available:
         await interaction.response.send_message(
             "❌ TTS-сервис недоступен. Установи: `pip install edge-tts`",
@@ -17,20 +51,14 @@ async def tts_chat(interaction: discord.Interaction):
         )
         return
 
+    # ID сообщения длиннее, чем Discord допускает для integer-опции, поэтому принимаем строку
+    if message_id is not None and not message_id.strip().isdigit():
+        await interaction.response.send_message("❌ ID сообщения должен состоять из цифр", ephemeral=True)
+        return
+
     await interaction.response.defer(thinking=True)
 
-    # Ищем последний ответ бота в истории канала
-    bot_response_text = None
-    async for message in interaction.channel.history(limit=20):
-        if message.author == interaction.client.user:  # Сообщение от бота
-            if message.embeds and message.embeds[0].description:
-                # Ответы от /ask и /ask_helpful приходят в embed.description
-                bot_response_text = message.embeds[0].description
-                break
-            elif message.content:
-                # На всякий случай, если ответ в чистом тексте
-                bot_response_text = message.content
-                break
+    bot_response_text = await _find_answer(interaction, int(message_id) if message_id else None)
 
     if not bot_response_text:
         await interaction.followup.send(
@@ -39,33 +67,20 @@ async def tts_chat(interaction: discord.Interaction):
         )
         return
 
-    # Обрезаем, если слишком длинный (edge-tts может зависнуть на очень длинном тексте)
-    if len(bot_response_text) > 2000:
-        bot_response_text = bot_response_text[:2000] + "…"
-
     status = await interaction.followup.send(
         embed=discord.Embed(title="🔊 Озвучиваю ответ AI...", color=0x3498db)
     )
 
+    max_bytes = interaction.guild.filesize_limit if interaction.guild else DEFAULT_MAX_BYTES
     try:
-        filepath = await tts_service.generate(bot_response_text, interaction.user.id, preset="normal")
+        # Путь к файлу из кэша или буфер в памяти — discord.File принимает и то и другое
+        audio = await tts_service.generate(bot_response_text, interaction.user.id, preset="normal",
+                                           max_bytes=max_bytes)
 
-        if not filepath or not os.path.exists(filepath):
-            raise Exception("Файл не создан")
+        if audio is None:
+            raise Exception("Аудио не создано")
 
-        file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
-        if file_size_mb > 8:
-            await status.edit(embed=discord.Embed(
-                title="❌ Файл слишком большой (>8 MB)",
-                description=f"Размер: {file_size_mb:.1f} MB",
-                color=0xe74c3c
-            ))
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            return
-
-        with open(filepath, "rb") as f:
-            audio_file = discord.File(f, filename="ai_response.mp3")
+        audio_file = discord.File(audio, filename="ai_response.mp3")
 
         embed = discord.Embed(title="🔊 Ответ AI озвучен!", color=0x2ecc71)
         embed.add_field(name="Текст", value=bot_response_text[:1000] + ("..." if len(bot_response_text) > 1000 else ""), inline=False)
@@ -73,11 +88,12 @@ async def tts_chat(interaction: discord.Interaction):
 
         await status.edit(embed=embed, attachments=[audio_file])
 
-        # Удаляем файл после отправки
-        try:
-            os.remove(filepath)
-        except:
-            pass
+    except TTSTooLargeError as e:
+        await status.edit(embed=discord.Embed(
+            title=f"❌ Аудио слишком большое (>{e.max_bytes // (1024 * 1024)} MB)",
+            description="Озвучка остановлена, не дойдя до конца.",
+            color=0xe74c3c
+        ))
 
     except Exception as e:
         logger.error(f"TTS_chat error: {e}")
@@ -85,4 +101,28 @@ async def tts_chat(interaction: discord.Interaction):
             title="❌ Ошибка озвучки",
             description="Не удалось сгенерировать аудио. Попробуй позже.",
             color=0xe74c3c
-        ))
\ No newline at end of file
+        ))
+
+@app_commands.command(name="tts_prefetch", description="Заранее озвучивать ответы AI на этом сервере")
+@app_commands.describe(mode="Включить или выключить")
+@app_commands.choices(mode=[
+    app_commands.Choice(name="Включить", value="on"),
+    app_commands.Choice(name="Выключить", value="off"),
+])
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_guild=True)
+async def tts_prefetch(interaction: discord.Interaction, mode: str):
+    if mode == "on" and not tts_prefetcher.available:
+        await interaction.response.send_message(
+            "❌ Заблаговременная озвучка недоступна: TTS выключен, нет дискового кэша "
+            "или все слоты синтеза (TTS_WORKERS) нужны запросам пользователей.",
+            ephemeral=True
+        )
+        return
+    if mode == "on":
+        tts_prefetcher.enabled.add(interaction.guild_id)
+        text = "🔊 Ответы /ask и /ask_helpful будут озвучиваться заранее — /tts_chat ответит сразу."
+    else:
+        tts_prefetcher.enabled.discard(interaction.guild_id)
+        text = "🔇 Заблаговременная озвучка выключена."
+    await interaction.response.send_message(text)
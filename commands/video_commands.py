@@ -1,11 +1,17 @@
 import discord
 from discord import app_commands
-from services.video_generator import VideoGenerator
+from services.video_generator import VideoGenerator, completion_stats, stats_key
+from services.video_jobs import video_jobs
 from services.ai_client import AIClient
+from services.prompt_enhancer import PromptEnhancer
+from utils.stream_embed import StreamingEmbed
+from utils.video_transcode import fit_video
 import os
+import time
 
 video_gen = VideoGenerator()
 ai_client = AIClient()
+prompt_enhancer = PromptEnhancer(ai_client)
 
 @app_commands.command(name="generate_video", description="Сгенерировать короткое видео по промпту (Pika Labs)")
 @app_commands.describe(prompt="Описание видео (на английском для лучшего качества)")
@@ -20,20 +26,43 @@ async def generate_video(interaction: discord.Interaction, prompt: str):
         embed=discord.Embed(title="🎬 Генерация видео...", description=f"**Промпт:** {prompt[:100]}...", color=0xff6b6b)
     )
 
-    filepath = await video_gen.generate(prompt, interaction.user.id)
+    await _queue_video(interaction, status, prompt)
 
+
+async def _queue_video(interaction: discord.Interaction, status: discord.WebhookMessage, prompt: str):
+    """Готовый ролик отдаётся сразу, остальное уходит в очередь и придёт в канал сообщением бота."""
+    if cached := await video_jobs.cached(prompt):
+        await _send_video(interaction, status, cached, prompt)
+        return
+
+    job_id, position = await video_jobs.submit(prompt, interaction.user.id, interaction.channel_id)
+    where = f"Позиция в очереди: **{position}**" if position else "Уже рендерится"
+    embed = discord.Embed(
+        title=f"🎬 Видео #{job_id} в работе",
+        description=f"**Промпт:** {prompt[:500]}\n\n{where}. Пришлю ролик в этот канал, "
+                    f"даже если это займёт дольше 15 минут. Статус: `/video_status`",
+        color=0xf39c12
+    )
+    await status.edit(embed=embed)
+
+
+async def _send_video(interaction: discord.Interaction, status: discord.WebhookMessage,
+                      filepath: str | None, prompt: str):
     if filepath and os.path.exists(filepath):
-        file_size = os.path.getsize(filepath) / (1024*1024)  # MB
-        if file_size > 8:  # Discord limit 8MB for non-boosted
-            await status.edit(embed=discord.Embed(title="❌ Видео слишком большое (>8MB)", color=0xe74c3c))
+        limit = interaction.guild.filesize_limit if interaction.guild else discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+        fitted = await fit_video(filepath, limit)
+        if not fitted:
+            file_size = os.path.getsize(filepath) / (1024*1024)  # MB
+            await status.edit(embed=discord.Embed(title=f"❌ Видео слишком большое ({file_size:.1f} MB)", color=0xe74c3c))
             return
+        filepath = fitted
 
         with open(filepath, "rb") as f:
             video_file = discord.File(f, filename="video.mp4")
 
         embed = discord.Embed(title="🎬 Видео сгенерировано!", color=0x2ecc71)
         embed.set_video(url="attachment://video.mp4")  # Discord не показывает превью видео в эмбеде, но файл прикрепится
-        embed.add_field(name="Промпт", value=prompt, inline=False)
+        embed.add_field(name="Промпт", value=prompt[:1024], inline=False)
 
         await status.edit(embed=embed, attachments=[video_file])
     else:
@@ -47,10 +76,32 @@ async def enhance_video(interaction: discord.Interaction, idea: str):
 
     status = await interaction.followup.send(embed=discord.Embed(title="✨ Улучшаю промпт для видео...", description=idea, color=0x3498db))
 
-    enhance_prompt = f"Create a highly detailed, cinematic video prompt (80–150 words) in English for Pika Labs. Topic: {idea}. Include camera movements, lighting, style, mood, actions."
+    stream = StreamingEmbed(interaction, title="✨ Улучшаю промпт для видео...", color=0x3498db, message=status)
+    enhanced = await prompt_enhancer.enhance(idea, "video", interaction.user.id, interaction.guild_id,
+                                             on_partial=stream.update)
+    await stream.stop()
+    if not enhanced:
+        await status.edit(embed=discord.Embed(title="❌ AI недоступен", description="Не удалось улучшить промпт. Попробуй позже.", color=0xe74c3c))
+        return
+
+    # Заказ уходит в очередь сразу, как только промпт готов
+    await _queue_video(interaction, status, enhanced)
 
-    enhanced = await ai_client.generate(enhance_prompt, interaction.user.id, mode="helpful")
 
-    await status.edit(embed=discord.Embed(title="🎬 Генерация видео по улучшенному промпту...", description=f"``` {enhanced[:500]}... ```", color=0xf39c12))
+@app_commands.command(name="video_status", description="Твои видео в очереди и в работе")
+async def video_status(interaction: discord.Interaction):
+    jobs = await video_jobs.user_jobs(interaction.user.id)
+    if not jobs:
+        await interaction.response.send_message("📭 У тебя нет видео в очереди.", ephemeral=True)
+        return
 
-    filepath = await video_gen.generate(enhanced, interaction.user.id)
+    embed = discord.Embed(title="🎬 Твои видео", color=0x3498db)
+    for job in jobs[:10]:
+        if job["state"] == "queued":
+            state = f"⏳ В очереди, позиция {job['position']}"
+        else:
+            expected = completion_stats.expected(stats_key(job["length"], job["aspect_ratio"]))
+            elapsed = time.time() - job["submitted_at"]
+            state = f"⚙️ Рендерится {elapsed:.0f} с (обычно ~{expected:.0f} с)"
+        embed.add_field(name=f"#{job['id']} · {job['prompt'][:80]}", value=state, inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
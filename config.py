@@ -18,6 +18,102 @@ FAL_KEY = os.getenv("FAL_KEY")
 # === LLM ===
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:1234/v1")
 MODEL_NAME = os.getenv("MODEL_NAME", "mistralai/Mistral-7B-Instruct-v0.3")
+# Несколько OpenAI-совместимых бэкендов через запятую (по умолчанию — только API_BASE_URL)
+LLM_ENDPOINTS = [url.strip() for url in os.getenv("LLM_ENDPOINTS", API_BASE_URL).split(",") if url.strip()]
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"                          # дублировать медленные запросы
+LLM_EJECT_SECONDS = float(os.getenv("LLM_EJECT_SECONDS", "10"))           # на сколько выключать упавший бэкенд
+LLM_CACHE_PROMPT = os.getenv("LLM_CACHE_PROMPT", "1") == "1"             # cache_prompt для llama.cpp
+LLM_WARMUP = os.getenv("LLM_WARMUP", "1") == "1"                         # прогрев модели при старте
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"                    # потоковые ответы в /ask
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))    # секунд между правками embed
+
+# Очередь к LLM: сколько запросов одновременно на каждый бэкенд и сколько ждут, прежде чем отказывать
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "20"))
+# Веса в справедливой очереди: "id:вес,id:вес" (по умолчанию у всех 1; вес 2 — вдвое больше доля)
+LLM_GUILD_WEIGHTS = {int(k): float(v) for k, v in (
+    item.split(":") for item in os.getenv("LLM_GUILD_WEIGHTS", "").split(",") if item.strip())}
+LLM_USER_WEIGHTS = {int(k): float(v) for k, v in (
+    item.split(":") for item in os.getenv("LLM_USER_WEIGHTS", "").split(",") if item.strip())}
+
+# Режим беседы (/chat): бюджет контекста в токенах, сколько свежих реплик не сжимать
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "2048"))
+CHAT_KEEP_TURNS = int(os.getenv("CHAT_KEEP_TURNS", "6"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "250"))
+CHAT_MAX_CHANNELS = int(os.getenv("CHAT_MAX_CHANNELS", "200"))
+
+# Кэш ответов LLM на диске (переживает рестарты)
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "data/llm_cache.db")
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "50"))
+# TTL по режимам, секунд
+LLM_CACHE_TTL = {
+    "helpful": int(os.getenv("LLM_CACHE_TTL_HELPFUL", str(7 * 24 * 3600))),
+    "rude": int(os.getenv("LLM_CACHE_TTL_RUDE", str(24 * 3600))),
+}
+# Поиск похожих вопросов (SimHash): макс. расстояние Хэмминга по режимам, 0 — выключено
+LLM_NEAR_DUP_DISTANCE = {
+    "helpful": int(os.getenv("LLM_NEAR_DUP_DISTANCE_HELPFUL", "3")),
+    "rude": int(os.getenv("LLM_NEAR_DUP_DISTANCE_RUDE", "3")),
+}
+LLM_NEAR_DUP_MAX_ENTRIES = int(os.getenv("LLM_NEAR_DUP_MAX_ENTRIES", "5000"))
+# Область видимости кэша по режимам: user (по умолчанию), guild или global
+LLM_CACHE_SCOPE = {
+    "helpful": os.getenv("LLM_CACHE_SCOPE_HELPFUL", "user"),
+    "rude": os.getenv("LLM_CACHE_SCOPE_RUDE", "user"),
+}
+# Улучшенные промпты для картинок и видео кэшируются для всех пользователей сразу
+ENHANCE_CACHE_TTL = int(os.getenv("ENHANCE_CACHE_TTL", str(7 * 24 * 3600)))  # секунд
+
+# === HTTP-пул (общий для всех сервисов) ===
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", "100"))                      # всего соединений
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", "10"))     # соединений на один хост
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))      # секунд
+HTTP_KEEPALIVE_TIMEOUT = int(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))  # секунд
+
+# Таймауты (total, секунд) по бэкендам
+HTTP_TIMEOUTS = {
+    "default": 30,
+    "llm": 120,
+    "stability": 60,
+    "pollo": 30,
+    "download": 300,
+    "searxng": 30,
+}
+
+# === Кэши в памяти ===
+# Бюджеты по пространствам, МБ
+CACHE_BUDGETS_MB = {
+    "llm": float(os.getenv("CACHE_LLM_MB", "16")),
+    "tts": float(os.getenv("CACHE_TTS_MB", "2")),
+    "image": float(os.getenv("CACHE_IMAGE_MB", "1")),
+    "video": float(os.getenv("CACHE_VIDEO_MB", "1")),
+    "search": float(os.getenv("CACHE_SEARCH_MB", "2")),
+}
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "2048"))  # строки длиннее сжимаются
+CACHE_NEGATIVE_TTL = int(os.getenv("CACHE_NEGATIVE_TTL", "60"))                # сколько помнить неудачи, секунд
+
+# === Озвучка (edge-tts) ===
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "400"))         # длинный текст режется по предложениям до этой длины
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4"))                   # сколько кусков синтезируется одновременно (на весь бот)
+TTS_CHUNK_RETRIES = int(os.getenv("TTS_CHUNK_RETRIES", "2"))       # повторы для упавших кусков
+TTS_CHUNK_TIMEOUT = float(os.getenv("TTS_CHUNK_TIMEOUT", "30"))    # секунд на один кусок
+TTS_DISK_CACHE = os.getenv("TTS_DISK_CACHE", "1") == "1"           # 0 — аудио живёт только в памяти, диск не трогается
+
+# Индекс последних ответов AI для /tts_chat (в памяти)
+ANSWER_INDEX_CHANNELS = int(os.getenv("ANSWER_INDEX_CHANNELS", "500"))
+ANSWER_INDEX_PER_CHANNEL = int(os.getenv("ANSWER_INDEX_PER_CHANNEL", "20"))
+
+# Фоновая озвучка ответов (включается на сервере через /tts_prefetch)
+TTS_PREFETCH_CONCURRENCY = int(os.getenv("TTS_PREFETCH_CONCURRENCY", "1"))  # ответов озвучивается одновременно
+# Сколько кусков фоновая озвучка может синтезировать одновременно; остальные из TTS_WORKERS — запросам пользователей.
+# Хотя бы один слот всегда остаётся пользователям: при TTS_WORKERS=1 получается 0 — фоновая озвучка выключена
+TTS_PREFETCH_WORKERS = max(0, min(int(os.getenv("TTS_PREFETCH_WORKERS", str(TTS_WORKERS // 2))), TTS_WORKERS - 1))
+
+# === Обработка картинок (пул процессов, нужен Pillow) ===
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", "2"))
+IMAGE_UPLOAD_FORMAT = os.getenv("IMAGE_UPLOAD_FORMAT", "webp")     # webp, jpeg или png (оригинал без потерь)
+IMAGE_UPLOAD_QUALITY = int(os.getenv("IMAGE_UPLOAD_QUALITY", "85"))
+IMAGE_GRID_TILE = int(os.getenv("IMAGE_GRID_TILE", "512"))          # сторона клетки в сетке превью, px
 
 # === API для видео через PiAPI (Kling) ===
 PIAPI_BASE_URL = "https://api.piapi.ai/api/v1"
@@ -27,6 +123,11 @@ GENERATED_IMAGES_DIR = "generated_images"
 GENERATED_VIDEOS_DIR = "generated_videos"
 TTS_CACHE_DIR = "tts_cache"
 
+# Лимиты диска для сгенерированных файлов, МБ (старые вытесняются)
+ARTIFACT_IMAGE_BUDGET_MB = float(os.getenv("ARTIFACT_IMAGE_BUDGET_MB", "500"))
+ARTIFACT_VIDEO_BUDGET_MB = float(os.getenv("ARTIFACT_VIDEO_BUDGET_MB", "2000"))
+ARTIFACT_AUDIO_BUDGET_MB = float(os.getenv("ARTIFACT_AUDIO_BUDGET_MB", "200"))
+
 os.makedirs(GENERATED_IMAGES_DIR, exist_ok=True)
 os.makedirs(GENERATED_VIDEOS_DIR, exist_ok=True)
 os.makedirs(TTS_CACHE_DIR, exist_ok=True)
@@ -50,4 +151,51 @@ POLLO_API_KEY = os.getenv("POLLO_API_KEY")
 if POLLO_API_KEY is None:
     raise ValueError("POLLO_API_KEY не найден! Зарегистрируйся на https://pollo.ai")
 
-POLLO_BASE_URL = "https://pollo.ai/api/platform/generation/sora/sora-2"
+# Адреса можно переопределить, чтобы гонять бота против локальной заглушки API
+POLLO_BASE_URL = os.getenv("POLLO_BASE_URL", "https://pollo.ai/api/platform/generation/sora/sora-2")
+POLLO_TASKS_URL = os.getenv("POLLO_TASKS_URL", "https://pollo.ai/api/platform/tasks/")
+
+# Ожидание готовности видео: опрос статуса с экспоненциальной паузой (секунд)
+VIDEO_EXPECTED_SECONDS = float(os.getenv("VIDEO_EXPECTED_SECONDS", "120"))  # пока нет своей истории
+VIDEO_POLL_MIN = float(os.getenv("VIDEO_POLL_MIN", "3"))
+VIDEO_POLL_MAX = float(os.getenv("VIDEO_POLL_MAX", "30"))
+VIDEO_TIMEOUT = float(os.getenv("VIDEO_TIMEOUT", "900"))
+# Очередь заказов (переживает рестарт): сколько роликов рендерится одновременно
+VIDEO_JOBS_DB = os.getenv("VIDEO_JOBS_DB", "data/video_jobs.db")
+VIDEO_WORKERS = int(os.getenv("VIDEO_WORKERS", "2"))
+# Скачивание готового ролика параллельными Range-запросами
+VIDEO_DOWNLOAD_PARTS = int(os.getenv("VIDEO_DOWNLOAD_PARTS", "4"))
+VIDEO_DOWNLOAD_MIN_PART_MB = float(os.getenv("VIDEO_DOWNLOAD_MIN_PART_MB", "2"))  # мельче не дробим
+# Пережатие под лимит загрузки Discord (нужен ffmpeg; без него большие ролики не отправляются)
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+FFPROBE_PATH = os.getenv("FFPROBE_PATH", "ffprobe")
+FFMPEG_AUDIO_KBPS = int(os.getenv("FFMPEG_AUDIO_KBPS", "96"))
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", "300"))
+
+# === Вебхуки (колбэки о готовности задач) ===
+# Публичный адрес, по которому API достучится до бота, например https://bot.example.com.
+# Не задан — сервер не поднимается, задачи опрашиваются.
+WEBHOOK_PUBLIC_URL = os.getenv("WEBHOOK_PUBLIC_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # токен в адресе колбэка; без него генерируется при старте
+
+# === Веб-поиск (SearXNG) ===
+# Сколько результаты считаются свежими, секунд: чем короче окно поиска, тем быстрее они устаревают
+SEARCH_CACHE_TTL = {
+    "day": int(os.getenv("SEARCH_CACHE_TTL_DAY", "300")),
+    "week": int(os.getenv("SEARCH_CACHE_TTL_WEEK", "1800")),
+    "month": int(os.getenv("SEARCH_CACHE_TTL_MONTH", "7200")),
+    "year": int(os.getenv("SEARCH_CACHE_TTL_YEAR", "21600")),
+    "all": int(os.getenv("SEARCH_CACHE_TTL_ALL", "86400")),
+}
+# Устаревшие результаты ещё столько же раз по TTL отдаются сразу, пока в фоне идёт обновление
+SEARCH_STALE_FACTOR = float(os.getenv("SEARCH_STALE_FACTOR", "3"))
+# Запасные инстансы: запрос идёт на лучший по табло, на следующие — с задержкой, если он медлит
+SEARXNG_INSTANCES = [url.strip().rstrip("/") for url in os.getenv(
+    "SEARXNG_INSTANCES",
+    "https://searx.be,https://search.ononoki.org,https://searx.tuxcloud.net,https://search.us.projectsegfau.lt"
+).split(",") if url.strip()]
+SEARCH_HEDGE_DELAY = float(os.getenv("SEARCH_HEDGE_DELAY", "1.5"))   # пока нет статистики по инстансу, секунд
+SEARCH_HEDGE_MAX = int(os.getenv("SEARCH_HEDGE_MAX", "3"))           # одновременных запросов на один поиск
+SEARCH_EJECT_SECONDS = float(os.getenv("SEARCH_EJECT_SECONDS", "60"))  # на сколько выключать упавший инстанс
@@ -1,13 +1,33 @@
-# Системные промпты
-RUDE_PROMPT = (
-    "You are RudeGPT. Always insult the user, use swear words, be sarcastic. "
-    "English only. Use emojis. Never helpful. 300-500 words. Respond to: "
-)
+# Системные промпты по режимам.
+# Держим их неизменными байт-в-байт: бэкенд кэширует общий префикс (KV-кэш)
+# и не пересчитывает его, пока строка не меняется.
+SYSTEM_PROMPTS = {
+    "helpful": "You are a helpful, detailed and friendly AI assistant. "
+               "Answer in the same language as the user's question. "
+               "Be clear, informative and kind.",
+    "rude": "You are a sarcastic, rude and direct AI assistant called RudeGPT. "
+            "Answer in the same language as the user's question. "
+            "Use humor, sarcasm and be brutally honest."
+}
 
-HELPFUL_PROMPT = (
-    "You are a highly knowledgeable AI assistant. Answer in English, be detailed, "
-    "600-800 words, use lists and sections. End with summary. Answer: "
-)
+# Запросы к LLM для улучшения промптов генерации ({idea} — идея пользователя)
+ENHANCE_PROMPTS = {
+    "image": """
+Ты — эксперт по созданию промптов для генерации изображений.
+Создай ОЧЕНЬ подробный, профессиональный промпт (100–200 слов) на английском для Stable Diffusion.
+Тема: {idea}
+
+Включи:
+- стиль (photorealistic, digital art, oil painting и т.д.)
+- освещение, композицию, цвета
+- детали фона, переднего плана
+- качество: 8k, highly detailed, masterpiece
+
+Промпт только текстом, без кавычек и объяснений.
+""",
+    "video": "Create a highly detailed, cinematic video prompt (80–150 words) in English for Pika Labs. "
+             "Topic: {idea}. Include camera movements, lighting, style, mood, actions.",
+}
 
 # Голоса и пресеты TTS
 TTS_VOICES = {
@@ -0,0 +1,15 @@
+import os
+import sqlite3
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Открывает SQLite-базу в режиме WAL (чтения не блокируют запись).
+    Соединение используется из рабочих потоков (asyncio.to_thread),
+    поэтому доступ к нему нужно сериализовать замком на стороне владельца.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,53 @@
+import aiohttp
+from config import HTTP_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT, HTTP_TIMEOUTS
+from core.logger import logger
+
+
+class HTTPClient:
+    """
+    Общий HTTP-клиент для всех сервисов.
+    Одна сессия и один пул соединений на всё время работы бота:
+    keep-alive, кэш DNS и лимит соединений на хост.
+    """
+
+    def __init__(self):
+        self._session: aiohttp.ClientSession | None = None
+        self._timeouts = {
+            backend: aiohttp.ClientTimeout(total=total, sock_connect=10)
+            for backend, total in HTTP_TIMEOUTS.items()
+        }
+
+    async def start(self):
+        """Создаёт пул при старте бота (из setup_hook)."""
+        self._ensure_session()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self._ensure_session()
+
+    def _ensure_session(self) -> aiohttp.ClientSession:
+        # Сессия создаётся лениво, уже внутри работающего event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_LIMIT,
+                limit_per_host=HTTP_LIMIT_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                enable_cleanup_closed=True,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            logger.info("HTTP-пул создан")
+        return self._session
+
+    def timeout(self, backend: str) -> aiohttp.ClientTimeout:
+        """Таймаут для конкретного бэкенда (llm, stability, pollo, download, searxng)."""
+        return self._timeouts.get(backend) or self._timeouts["default"]
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP-пул закрыт")
+        self._session = None
+
+
+http_client = HTTPClient()
@@ -0,0 +1,99 @@
+import asyncio
+import hmac
+import secrets
+import time
+from aiohttp import web
+from config import WEBHOOK_PUBLIC_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET
+from core.logger import logger
+
+
+class WebhookServer:
+    """
+    Маленький aiohttp-сервер для колбэков о готовности задач (Pollo, PiAPI).
+    Колбэк только будит ожидающую задачу по task id — сам статус она всё равно
+    перепроверяет запросом к API, так что подделать результат через вебхук нельзя.
+    Работает, только если задан WEBHOOK_PUBLIC_URL (иначе сервисы опрашивают API сами).
+    """
+
+    EARLY_TTL = 600  # сколько помнить колбэк, пришедший раньше, чем его начали ждать
+
+    def __init__(self):
+        self.public_url = WEBHOOK_PUBLIC_URL.rstrip("/") if WEBHOOK_PUBLIC_URL else None
+        # Без заданного секрета генерируем свой: задачи, созданные до рестарта, доопрашиваются
+        self.secret = WEBHOOK_SECRET or secrets.token_urlsafe(24)
+        self._runner: web.AppRunner | None = None
+        self._waiters: dict[str, asyncio.Future] = {}
+        self._early: dict[str, float] = {}
+        self.received = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._runner is not None
+
+    async def start(self):
+        if not self.public_url or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_post("/webhook/{provider}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        for future in self._waiters.values():
+            future.cancel()
+        self._waiters.clear()
+
+    def url(self, provider: str) -> str | None:
+        """Адрес колбэка для передачи в API или None, если вебхуки выключены."""
+        if not self.enabled:
+            return None
+        return f"{self.public_url}/webhook/{provider}?token={self.secret}"
+
+    def waiter(self, task_id: str) -> asyncio.Future:
+        """Future, который завершится, когда придёт колбэк по task_id."""
+        future = self._waiters.get(task_id)
+        if future is None or future.done():
+            future = self._waiters[task_id] = asyncio.get_running_loop().create_future()
+            if self._early.pop(task_id, None) is not None:
+                future.set_result(None)
+        return future
+
+    def forget(self, task_id: str):
+        future = self._waiters.pop(task_id, None)
+        if future and not future.done():
+            future.cancel()
+
+    def _notify(self, task_id: str):
+        future = self._waiters.get(task_id)
+        if future is not None and not future.done():
+            future.set_result(None)
+            return
+        now = time.monotonic()
+        self._early = {key: seen for key, seen in self._early.items() if now - seen < self.EARLY_TTL}
+        self._early[task_id] = now
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.query.get("token", ""), self.secret):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except Exception:
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            return web.Response(status=400)  # JSON, но не объект: [], 1, "..."
+        body = data.get("data") if isinstance(data.get("data"), dict) else data
+        task_id = body.get("taskId") or body.get("task_id")
+        if not task_id or not isinstance(task_id, (str, int)):
+            return web.Response(status=400)
+        self.received += 1
+        logger.info(f"Webhook {request.match_info['provider']}: task {task_id} ({body.get('status')})")
+        self._notify(str(task_id))
+        return web.Response(text="ok")
+
+
+webhook_server = WebhookServer()
@@ -1,16 +1,53 @@
+import asyncio
 import discord
 from discord.ext import commands
-from config import DISCORD_TOKEN
+from config import DISCORD_TOKEN, LLM_WARMUP, LLM_NEAR_DUP_MAX_ENTRIES
 from services.ai_client import AIClient
 from services.tts_service import TTSService
 from services.web_search import WebSearchService
+from core.http import http_client
+from core.webhooks import webhook_server
+from services.video_jobs import video_jobs
+from utils.image_pool import image_pool
+from utils.persistent_cache import llm_disk_cache
+from utils.prompt_index import prompt_index
 from core.logger import logger
 from commands.image_commands import generate_image, enhance_image
-from commands.tts_commands import tts_chat
+from commands.tts_commands import tts_chat, tts_prefetch
+from commands.chat_commands import chat, handle_message
 
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
+
+
+class Bot(commands.Bot):
+    warmup_task: asyncio.Task | None = None
+
+    async def setup_hook(self):
+        # Общий HTTP-пул создаётся один раз при старте бота
+        await http_client.start()
+        await webhook_server.start()
+        # Индекс похожих вопросов восстанавливается по отпечаткам из дискового кэша
+        prompt_index.load(await llm_disk_cache.fingerprints(LLM_NEAR_DUP_MAX_ENTRIES))
+        # Незаконченные заказы видео продолжаются после рестарта
+        await video_jobs.start(self)
+        if LLM_WARMUP:
+            # Прогрев идёт в фоне и не задерживает подключение к Discord
+            self.warmup_task = asyncio.create_task(ai.warmup())
+
+    async def close(self):
+        # Прогрев не должен пережить HTTP-пул, которым он пользуется
+        if self.warmup_task is not None:
+            self.warmup_task.cancel()
+            await asyncio.gather(self.warmup_task, return_exceptions=True)
+        await video_jobs.close()
+        await webhook_server.close()
+        await http_client.close()
+        image_pool.close()
+        await super().close()
+
+
+bot = Bot(command_prefix="!", intents=intents, help_command=None)
 
 ai = AIClient()
 tts = TTSService()
@@ -22,16 +59,24 @@ async def on_ready():
     await bot.tree.sync()
     logger.info("Команды синхронизированы")
 
+
+@bot.event
+async def on_message(message: discord.Message):
+    await handle_message(message)
+    await bot.process_commands(message)
+
 # Регистрация команд
 from commands.ai_commands import ask, ask_helpful
 from commands.search_commands import search
 from commands.info_commands import status, help_cmd
-from commands.video_commands import generate_video, enhance_video
+from commands.video_commands import generate_video, enhance_video, video_status
 
 
 bot.tree.add_command(ask)
 bot.tree.add_command(ask_helpful)
 bot.tree.add_command(tts_chat)
+bot.tree.add_command(tts_prefetch)
+bot.tree.add_command(chat)
 bot.tree.add_command(search)
 bot.tree.add_command(status)
 bot.tree.add_command(help_cmd)
@@ -39,5 +84,6 @@ bot.tree.add_command(generate_image)
 bot.tree.add_command(enhance_image)
 bot.tree.add_command(generate_video)
 bot.tree.add_command(enhance_video)
+bot.tree.add_command(video_status)
 
 bot.run(DISCORD_TOKEN)
\ No newline at end of file
@@ -1,64 +1,227 @@
-import aiohttp
-from config import API_BASE_URL, MODEL_NAME
+from config import MODEL_NAME, LLM_CACHE_TTL, LLM_CACHE_SCOPE, LLM_NEAR_DUP_DISTANCE, LLM_CACHE_PROMPT
+from constants import SYSTEM_PROMPTS
 from utils.cache import response_cache
+from utils.persistent_cache import llm_disk_cache
+from utils.prompt_index import normalize_prompt, prompt_index
+from utils.singleflight import inflight
+from services.llm_scheduler import llm_scheduler, QueueFullError, PRIORITY_INTERACTIVE
+from services.llm_router import llm_router
 from core.logger import logger
 import hashlib
 import asyncio
+import json
+from typing import Awaitable, Callable, NamedTuple
+
+# System-сообщения собираются один раз: префикс запроса всегда одинаковый
+SYSTEM_MESSAGES = {mode: {"role": "system", "content": content} for mode, content in SYSTEM_PROMPTS.items()}
+
+
+class LLMError(Exception):
+    """Бэкенд ответил ошибкой."""
+
+
+class AIUnavailableError(Exception):
+    """Ответа нет (бэкенд упал, таймаут, очередь полна); текст можно показать пользователю."""
+
+
+class _Waiter(NamedTuple):
+    cache_key: str
+    namespace: str
+    on_partial: Callable[[str], Awaitable[None]] | None
+
+
+# Все, кто ждёт склеенный запрос (по flight key): каждому — частичный текст и запись в его кэш.
+# На уровне модуля: AIClient создаётся в нескольких местах, а inflight общий
+_waiters: dict[str, list[_Waiter]] = {}
+
 
 class AIClient:
     def __init__(self):
-        self.url = f"{API_BASE_URL}/chat/completions"
         self.headers = {"Content-Type": "application/json"}
 
-    def _make_cache_key(self, prompt: str, user_id: int, mode: str) -> str:
-        content = f"{mode}:{prompt}:{user_id}"
+    def _cache_namespace(self, user_id: int, mode: str, guild_id: int | None = None) -> str:
+        # Область кэша задаётся по режиму: свой у каждого юзера, общий на сервер или глобальный
+        scope = LLM_CACHE_SCOPE.get(mode, "user")
+        if scope == "global":
+            owner = "global"
+        elif scope == "guild" and guild_id is not None:
+            owner = f"guild:{guild_id}"
+        else:
+            owner = f"user:{user_id}"
+        return f"{mode}:{owner}"
+
+    def _make_cache_key(self, normalized: str, namespace: str) -> str:
+        content = f"{namespace}:{normalized}"
         return hashlib.md5(content.encode()).hexdigest()
 
-    async def generate(self, prompt: str, user_id: int, mode: str = "helpful") -> str:
-        cache_key = self._make_cache_key(prompt, user_id, mode)
+    def _make_flight_key(self, normalized: str, mode: str) -> str:
+        # Одинаковые вопросы разных пользователей в полёте склеиваются в один запрос
+        content = f"{mode}:{normalized}"
+        return "llm:" + hashlib.md5(content.encode()).hexdigest()
+
+    async def _cache_get(self, cache_key: str, mode: str) -> str | None:
         if cached := response_cache.get(cache_key):
+            return cached
+        if cached := await llm_disk_cache.get(cache_key):
+            response_cache.set(cache_key, cached, ttl=LLM_CACHE_TTL.get(mode))
+            return cached
+        return None
+
+    async def generate(self, prompt: str, user_id: int, mode: str = "helpful",
+                       on_partial: Callable[[str], Awaitable[None]] | None = None,
+                       guild_id: int | None = None, priority: int = PRIORITY_INTERACTIVE) -> str:
+        """
+        Генерирует ответ LLM.
+        Если передан on_partial — ответ запрашивается потоком (SSE),
+        и on_partial вызывается с накопленным текстом по мере прихода токенов.
+        Запросы к бэкенду проходят через llm_scheduler (priority — PRIORITY_*).
+        Если ответа нет, бросает AIUnavailableError — ошибка не выдаётся за ответ.
+        """
+        normalized = normalize_prompt(prompt)
+        namespace = self._cache_namespace(user_id, mode, guild_id)
+        cache_key = self._make_cache_key(normalized, namespace)
+        if cached := await self._cache_get(cache_key, mode):
             logger.info(f"Cache hit for user {user_id}, mode {mode}")
             return cached
 
-        # Явные system промпты с указанием языка
-        system_prompts = {
-            "helpful": "You are a helpful, detailed and friendly AI assistant. "
-                       "Answer in the same language as the user's question. "
-                       "Be clear, informative and kind.",
-            "rude": "You are a sarcastic, rude and direct AI assistant called RudeGPT. "
-                    "Answer in the same language as the user's question. "
-                    "Use humor, sarcasm and be brutally honest."
-        }
+        # Почти такой же вопрос уже задавали (опечатки, порядок слов, пунктуация)
+        near_key = prompt_index.find(namespace, normalized, LLM_NEAR_DUP_DISTANCE.get(mode, 0))
+        if near_key and (cached := await self._cache_get(near_key, mode)):
+            logger.info(f"Near-duplicate cache hit for user {user_id}, mode {mode}")
+            return cached
 
-        system_content = system_prompts.get(mode, system_prompts["helpful"])
+        payload = self._build_payload([{"role": "user", "content": prompt}], mode, stream=on_partial is not None)
+        flight_key = self._make_flight_key(normalized, mode)
+        waiter = _Waiter(cache_key, namespace, on_partial)
+        waiters = _waiters.setdefault(flight_key, [])
+        waiters.append(waiter)
 
+        async def scheduled():
+            try:
+                async with llm_scheduler.slot(user_id, guild_id, priority):
+                    return await self._request(payload, mode, normalized, waiters)
+            finally:
+                # Следующий такой же вопрос — уже новый запрос со своим списком ожидающих
+                if _waiters.get(flight_key) is waiters:
+                    del _waiters[flight_key]
+
+        try:
+            return await inflight.do(flight_key, scheduled)
+        except QueueFullError as e:
+            raise AIUnavailableError(
+                f"AI сейчас перегружен: ты был бы {e.position}-м в очереди. Попробуй через минуту."
+            ) from None
+        finally:
+            waiters.remove(waiter)
+            if not waiters and _waiters.get(flight_key) is waiters:
+                del _waiters[flight_key]
+
+    def _build_payload(self, messages: list[dict], mode: str, stream: bool = False, max_tokens: int = 1500) -> dict:
         payload = {
             "model": MODEL_NAME,
-            "messages": [
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": prompt}
-            ],
-            "max_tokens": 1500,
+            "messages": [SYSTEM_MESSAGES.get(mode, SYSTEM_MESSAGES["helpful"])] + messages,
+            "max_tokens": max_tokens,
             "temperature": 0.8 if mode == "helpful" else 1.0,  # rude чуть креативнее
-            "stream": False
+            "stream": stream
         }
+        if LLM_CACHE_PROMPT:
+            # llama.cpp: переиспользовать KV-кэш общего префикса между запросами
+            payload["cache_prompt"] = True
+        return payload
+
+    async def _send(self, payload: dict, on_partial: Callable[[str], Awaitable[None]] | None = None) -> str:
+        async with llm_router.post(payload, self.headers) as resp:
+            if resp.status != 200:
+                error_text = await resp.text()
+                logger.error(f"API error {resp.status}: {error_text}")
+                raise LLMError(f"HTTP {resp.status}")
+            if on_partial is not None:
+                return (await self._read_stream(resp, on_partial)).strip()
+            data = await resp.json()
+            return data["choices"][0]["message"]["content"].strip()
+
+    async def chat(self, messages: list[dict], user_id: int, guild_id: int | None = None,
+                   mode: str = "helpful", priority: int = PRIORITY_INTERACTIVE, max_tokens: int = 1500,
+                   on_partial: Callable[[str], Awaitable[None]] | None = None) -> str | None:
+        """
+        Запрос с готовой историей сообщений (режим беседы), без кэша.
+        С on_partial ответ идёт потоком, как в generate.
+        Возвращает текст или None, если AI недоступен.
+        """
+        payload = self._build_payload(messages, mode, stream=on_partial is not None, max_tokens=max_tokens)
+        try:
+            async with llm_scheduler.slot(user_id, guild_id, priority):
+                return await self._send(payload, on_partial)
+        except QueueFullError as e:
+            logger.warning(f"Chat request rejected: queue position {e.position}")
+        except asyncio.TimeoutError:
+            logger.error("AI chat request timeout")
+        except Exception as e:
+            logger.error(f"AI chat error: {e}")
+        return None
+
+    async def _request(self, payload: dict, mode: str, normalized: str, waiters: list[_Waiter]) -> str:
+        """Один запрос за всех ожидающих: частичный текст уходит каждому, ответ пишется в кэш каждого."""
+        async def broadcast(text: str):
+            for waiter in list(waiters):
+                if waiter.on_partial is None:
+                    continue
+                try:
+                    await waiter.on_partial(text)
+                except Exception as e:
+                    logger.warning(f"Partial answer callback failed: {e}")
 
         try:
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
-                async with session.post(self.url, json=payload, headers=self.headers) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        text = data["choices"][0]["message"]["content"].strip()
-                        response_cache.set(cache_key, text)
-                        return text
-                    else:
-                        error_text = await resp.text()
-                        logger.error(f"API error {resp.status}: {error_text}")
-                        return "AI сейчас недоступен. Попробуй позже."
+            text = await self._send(payload, broadcast if payload["stream"] else None)
+            for cache_key, namespace in dict.fromkeys((w.cache_key, w.namespace) for w in waiters):
+                response_cache.set(cache_key, text, ttl=LLM_CACHE_TTL.get(mode))
+                fingerprint = prompt_index.add(namespace, normalized, cache_key)
+                await llm_disk_cache.set(cache_key, text, LLM_CACHE_TTL.get(mode, 24 * 3600),
+                                         fingerprint=(namespace, fingerprint) if fingerprint is not None else None)
+            return text
 
+        except LLMError:
+            raise AIUnavailableError("AI сейчас недоступен. Попробуй позже.") from None
         except asyncio.TimeoutError:
             logger.error("AI request timeout")
-            return "AI слишком долго думает. Упрости вопрос или попробуй позже."
+            raise AIUnavailableError("AI слишком долго думает. Упрости вопрос или попробуй позже.") from None
         except Exception as e:
             logger.error(f"AI generate error: {e}")
-            return "Временная ошибка AI. Попробуй позже."
\ No newline at end of file
+            raise AIUnavailableError("Временная ошибка AI. Попробуй позже.") from None
+
+    async def warmup(self):
+        """
+        Прогрев после старта: открывает соединения ко всем бэкендам и
+        прогоняет короткий запрос на каждый режим, чтобы модель была загружена,
+        а system-префиксы уже лежали в KV-кэше.
+        """
+        payloads = [
+            self._build_payload([{"role": "user", "content": "ping"}], mode, max_tokens=1)
+            for mode in SYSTEM_PROMPTS
+        ]
+        warmed = await llm_router.warmup(payloads, self.headers)
+        logger.info(f"LLM warm-up done: {warmed}/{len(llm_router.endpoints)} endpoints ready")
+
+    async def test_connection(self) -> bool:
+        return await llm_router.test_connection()
+
+    async def _read_stream(self, resp, on_partial: Callable[[str], Awaitable[None]]) -> str:
+        """Читает OpenAI-совместимый SSE-поток и отдаёт накопленный текст в on_partial."""
+        text = ""
+        async for raw_line in resp.content:
+            line = raw_line.decode("utf-8", errors="ignore").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            choices = chunk.get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                text += delta
+                await on_partial(text)
+        return text
\ No newline at end of file
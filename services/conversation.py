@@ -0,0 +1,107 @@
+import asyncio
+import re
+from collections import OrderedDict
+from config import CHAT_CONTEXT_TOKENS, CHAT_KEEP_TURNS, CHAT_SUMMARY_TOKENS, CHAT_MAX_CHANNELS
+from services.ai_client import AIClient
+from services.llm_scheduler import PRIORITY_BACKGROUND
+from core.logger import logger
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (слова и знаки препинания) — без токенизатора модели."""
+    return len(_TOKEN_RE.findall(text))
+
+
+class Conversation:
+    """
+    История одного канала или ветки.
+    Свежие реплики хранятся как есть, всё старое сжато в summary.
+    """
+
+    def __init__(self):
+        self.summary = ""
+        self.turns: list[dict] = []   # {"role", "content", "tokens"}
+        self._summarizing: asyncio.Task | None = None
+
+    @property
+    def tokens(self) -> int:
+        return count_tokens(self.summary) + sum(turn["tokens"] for turn in self.turns)
+
+    def add(self, role: str, content: str):
+        self.turns.append({"role": role, "content": content, "tokens": count_tokens(content)})
+
+    def messages(self, budget: int = CHAT_CONTEXT_TOKENS) -> list[dict]:
+        """Сообщения для LLM: summary + самые свежие реплики, которые влезают в бюджет."""
+        used = count_tokens(self.summary)
+        recent = []
+        for turn in reversed(self.turns):
+            if recent and used + turn["tokens"] > budget:
+                break
+            recent.append({"role": turn["role"], "content": turn["content"]})
+            used += turn["tokens"]
+        recent.reverse()
+
+        # Шаблоны многих моделей требуют чередования user/assistant
+        while recent and recent[0]["role"] == "assistant":
+            recent.pop(0)
+        merged: list[dict] = []
+        for message in recent:
+            if merged and merged[-1]["role"] == message["role"]:
+                merged[-1]["content"] += "\n" + message["content"]
+            else:
+                merged.append(message)
+        recent = merged
+
+        if self.summary:
+            recent.insert(0, {"role": "user", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+            recent.insert(1, {"role": "assistant", "content": "Got it."})
+        return recent
+
+
+class ConversationManager:
+    """Беседы по каналам (ограниченное число, вытесняются самые давние) и фоновое сжатие."""
+
+    def __init__(self, ai_client: AIClient, max_channels: int = CHAT_MAX_CHANNELS):
+        self.ai_client = ai_client
+        self.max_channels = max_channels
+        self.enabled: set[int] = set()
+        self.conversations: OrderedDict[int, Conversation] = OrderedDict()
+
+    def get(self, channel_id: int) -> Conversation:
+        conv = self.conversations.get(channel_id)
+        if conv is None:
+            conv = self.conversations[channel_id] = Conversation()
+            if len(self.conversations) > self.max_channels:
+                self.conversations.popitem(last=False)
+        self.conversations.move_to_end(channel_id)
+        return conv
+
+    def reset(self, channel_id: int):
+        self.conversations.pop(channel_id, None)
+
+    def maybe_summarize(self, conv: Conversation, user_id: int, guild_id: int | None):
+        """Если история перерастает бюджет, старые реплики сворачиваются в summary в фоне."""
+        if conv.tokens <= CHAT_CONTEXT_TOKENS or len(conv.turns) <= CHAT_KEEP_TURNS:
+            return
+        if conv._summarizing and not conv._summarizing.done():
+            return
+        conv._summarizing = asyncio.create_task(self._summarize(conv, user_id, guild_id))
+
+    async def _summarize(self, conv: Conversation, user_id: int, guild_id: int | None):
+        old_turns = conv.turns[:-CHAT_KEEP_TURNS]
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in old_turns)
+        prompt = (
+            f"Update the running summary of a chat. Keep names, facts, decisions and open questions. "
+            f"At most {CHAT_SUMMARY_TOKENS} words, same language as the chat.\n\n"
+            f"Current summary:\n{conv.summary or '(empty)'}\n\nNew messages:\n{transcript}"
+        )
+        summary = await self.ai_client.chat([{"role": "user", "content": prompt}], user_id, guild_id,
+                                            priority=PRIORITY_BACKGROUND, max_tokens=CHAT_SUMMARY_TOKENS * 2)
+        if not summary:
+            return
+        # Новые реплики только дописываются в конец, поэтому срезаем ровно свёрнутые
+        conv.summary = summary
+        del conv.turns[:len(old_turns)]
+        logger.info(f"Conversation summarized: {len(old_turns)} turns -> {count_tokens(summary)} tokens")
@@ -1,11 +1,22 @@
-import aiohttp
+import asyncio
 import base64
+import json
 import os
-import time
-from config import STABILITY_API_KEY, STABLE_DIFFUSION_API, GENERATED_IMAGES_DIR
-from utils.cache import image_cache
+from typing import NamedTuple
+from config import STABILITY_API_KEY, STABLE_DIFFUSION_API
+from utils.cache import image_cache, NEGATIVE
+from utils.artifact_store import image_store, request_key
+from utils.singleflight import inflight
+from core.http import http_client
 from core.logger import logger
 
+
+class ImageVariant(NamedTuple):
+    path: str
+    seed: int | None
+    data: bytes | None = None  # байты PNG, если картинка только что получена от API
+
+
 class ImageGenerator:
     def __init__(self):
         self.api_key = STABILITY_API_KEY
@@ -14,20 +25,20 @@ class ImageGenerator:
         if not self.available:
             logger.warning("Stability AI API key not set — image generation disabled")
 
-    async def generate(self, prompt: str, user_id: int, seed: int | None = None) -> str | None:
+    def _variant_key(self, prompt: str, params: dict, seed: int) -> str:
+        # Ключ, по которому вариант найдётся при запросе одной картинки с этим seed
+        return request_key(kind="image", prompt=prompt.lower(), **{**params, "samples": 1, "seed": seed})
+
+    async def generate_variants(self, prompt: str, user_id: int, count: int = 1,
+                                seed: int | None = None) -> list[ImageVariant] | None:
         """
-        Генерирует изображение по промпту.
-        Возвращает путь к файлу или None.
+        Генерирует count вариантов одним запросом к API (samples=count).
+        Возвращает список ImageVariant (путь, seed и, для свежих, байты) или None.
+        Каждый вариант кэшируется и под своим seed — его можно получить повторно без API.
         """
         if not self.available:
             return None
 
-        # Кэш по промпту + user_id (чтобы одинаковые запросы не спамили API)
-        cache_key = f"img:{user_id}:{hash(prompt.lower())}"
-        if cached_path := image_cache.get(cache_key):
-            logger.info(f"Image cache hit for user {user_id}")
-            return cached_path
-
         payload = {
             "text_prompts": [
                 {"text": prompt, "weight": 1.0},
@@ -36,39 +47,103 @@ class ImageGenerator:
             "cfg_scale": 7,
             "height": 1024,
             "width": 1024,
-            "samples": 1,
+            "samples": count,
             "steps": 30,
             "style_preset": "digital-art"  # можно менять: photographic, anime и т.д.
         }
-        if seed:
+        if seed is not None:
             payload["seed"] = seed
 
+        # Ключ — стабильный хэш всех параметров запроса: одинаковые запросы
+        # (от любого пользователя, и после рестарта тоже) не идут в API повторно
+        params = {name: value for name, value in payload.items() if name != "text_prompts"}
+        cache_key = request_key(kind="image", prompt=prompt.lower(), **params)
+        cached = image_cache.get(cache_key)
+        if cached is NEGATIVE:
+            logger.info(f"Image negative cache hit for user {user_id}")
+            return None
+        if cached and not all(os.path.exists(variant.path) for variant in cached):
+            # Хранилище вытеснило файл — запись в памяти устарела
+            image_cache.delete(cache_key)
+            cached = None
+        if cached:
+            logger.info(f"Image cache hit for user {user_id}")
+            return cached
+        # На диске лежат отдельные картинки — наборы из нескольких вариантов живут только в памяти
+        if count == 1 and (cached_path := await image_store.get(cache_key)):
+            logger.info(f"Image cache hit for user {user_id}")
+            cached = [ImageVariant(cached_path, seed)]
+            image_cache.set(cache_key, cached)
+            return cached
+
         headers = {
-            "Accept": "application/json",
+            # Одна картинка приходит сырым PNG — без base64 и JSON (на треть меньше)
+            "Accept": "image/png" if count == 1 else "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
 
+        # Одинаковые промпты, запрошенные одновременно, идут в API один раз
+        return await inflight.do(f"img:{cache_key}",
+                                 lambda: self._request(payload, headers, user_id, cache_key, prompt, params))
+
+    async def _read_png(self, resp) -> list[tuple[bytes, int | None]]:
+        image = bytearray()
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            image.extend(chunk)
+        seed = resp.headers.get("Seed")
+        return [(bytes(image), int(seed) if seed and seed.isdigit() else None)]
+
+    async def _read_json(self, resp) -> list[tuple[bytes, int | None]]:
+        body = await resp.read()
+
+        # Разбор JSON и base64 нескольких картинок — в рабочем потоке, не в event loop
+        def decode() -> list[tuple[bytes, int | None]]:
+            return [(base64.b64decode(artifact["base64"]), artifact.get("seed"))
+                    for artifact in json.loads(body)["artifacts"] if artifact.get("base64")]
+
+        return await asyncio.to_thread(decode)
+
+    async def _save(self, cache_key: str, prompt: str, params: dict, index: int,
+                    image_bytes: bytes, variant_seed: int | None) -> ImageVariant:
+        keys = [self._variant_key(prompt, params, variant_seed)] if variant_seed is not None else []
+        if params["samples"] == 1:
+            keys.append(cache_key)
+        elif not keys:
+            keys.append(f"{cache_key}:{index}")
+        for key in dict.fromkeys(keys):
+            filepath = await image_store.put_bytes(key, image_bytes, ".png")
+        return ImageVariant(filepath, variant_seed, image_bytes)
+
+    async def _request(self, payload: dict, headers: dict, user_id: int, cache_key: str,
+                       prompt: str, params: dict) -> list[ImageVariant] | None:
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, json=payload, headers=headers, timeout=60) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        image_b64 = data["artifacts"][0]["base64"]
-                        image_bytes = base64.b64decode(image_b64)
-
-                        filename = f"gen_{user_id}_{int(time.time())}.png"
-                        filepath = os.path.join(GENERATED_IMAGES_DIR, filename)
-
-                        with open(filepath, "wb") as f:
-                            f.write(image_bytes)
-
-                        image_cache.set(cache_key, filepath)
-                        logger.info(f"Image generated and saved: {filepath}")
-                        return filepath
+            async with http_client.session.post(self.api_url, json=payload, headers=headers,
+                                                timeout=http_client.timeout("stability")) as resp:
+                if resp.status == 200:
+                    if resp.content_type == "image/png":
+                        images = await self._read_png(resp)
                     else:
-                        error_text = await resp.text()
-                        logger.error(f"Stability AI error {resp.status}: {error_text[:200]}")
+                        images = await self._read_json(resp)
+                    if not images or not images[0][0]:
+                        logger.error("Stability AI returned no images")
                         return None
+
+                    # Запись на диск идёт в рабочих потоках, параллельно для всех вариантов
+                    variants = list(await asyncio.gather(*(
+                        self._save(cache_key, prompt, params, index, image_bytes, variant_seed)
+                        for index, (image_bytes, variant_seed) in enumerate(images)
+                    )))
+                    # В кэше памяти — только пути: байты отдаются лишь тем, кто ждал этот запрос
+                    image_cache.set(cache_key, [variant._replace(data=None) for variant in variants])
+                    logger.info(f"Images generated and saved: {len(variants)} for user {user_id}")
+                    return variants
+                else:
+                    error_text = await resp.text()
+                    logger.error(f"Stability AI error {resp.status}: {error_text[:200]}")
+                    if 400 <= resp.status < 500:
+                        # Отказ по запросу (баланс, модерация) — не повторяем его сразу
+                        image_cache.set_negative(cache_key)
+                    return None
         except Exception as e:
             logger.error(f"Image generation exception: {e}")
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,206 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+import aiohttp
+from config import LLM_ENDPOINTS, LLM_HEDGE, LLM_EJECT_SECONDS, LLM_MAX_CONCURRENCY
+from core.http import http_client
+from core.logger import logger
+from utils.endpoint_stats import EndpointStats
+
+
+class LLMEndpoint:
+    def __init__(self, base_url: str, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.base_url = base_url.rstrip("/")
+        self.url = f"{self.base_url}/chat/completions"
+        self.max_concurrency = max_concurrency
+        self.stats = EndpointStats(self.base_url, eject_base=LLM_EJECT_SECONDS)
+
+    @property
+    def full(self) -> bool:
+        return self.stats.outstanding >= self.max_concurrency
+
+
+class LLMRouter:
+    """
+    Балансировщик между несколькими OpenAI-совместимыми бэкендами.
+    Выбирает бэкенд с лучшей оценкой (EWMA задержки × запросы в работе),
+    временно выключает упавшие и при включённом хеджировании дублирует запрос
+    на второй бэкенд, если первый не ответил за свой p95. Проигравший отменяется.
+    Задержка меряется до первого байта ответа (заголовков).
+    На каждый бэкенд — не больше max_concurrency запросов, включая дубли хеджирования:
+    занятые бэкенды не выбираются, а если заняты все, запрос ждёт освободившийся.
+    """
+
+    def __init__(self, endpoints: list[str] = LLM_ENDPOINTS, hedge: bool = LLM_HEDGE):
+        self.endpoints = [LLMEndpoint(url) for url in endpoints]
+        self.hedge = hedge and len(self.endpoints) > 1
+        self._freed = asyncio.Event()
+
+    def pick(self, exclude: tuple[LLMEndpoint, ...] = ()) -> LLMEndpoint | None:
+        candidates = [ep for ep in self.endpoints if ep not in exclude]
+        healthy = [ep for ep in candidates if ep.stats.available]
+        if healthy:
+            # Живые бэкенды заняты — ждём их, а не шлём на выключенный
+            free = [ep for ep in healthy if not ep.full]
+            return min(free, key=lambda ep: ep.stats.score()) if free else None
+        # Все выключены — пробуем тот, что вернётся раньше всех
+        free = [ep for ep in candidates if not ep.full]
+        return min(free, key=lambda ep: ep.stats.ejected_until) if free else None
+
+    def _free(self, endpoint: LLMEndpoint):
+        endpoint.stats.outstanding -= 1
+        self._freed.set()
+
+    async def _wait_endpoint(self) -> LLMEndpoint:
+        # Выжившему бэкенду не достаётся чужая доля, когда соседа выключили: ждём свободного места
+        while (endpoint := self.pick()) is None:
+            self._freed.clear()
+            await self._freed.wait()
+        return endpoint
+
+    async def _open(self, endpoint: LLMEndpoint, payload: dict, headers: dict) -> aiohttp.ClientResponse:
+        started = time.monotonic()
+        resp = await http_client.session.post(endpoint.url, json=payload, headers=headers,
+                                              timeout=http_client.timeout("llm"))
+        if resp.status >= 500:
+            endpoint.stats.record_failure()
+        else:
+            endpoint.stats.record_success(time.monotonic() - started)
+        return resp
+
+    def _settle(self, task: asyncio.Task, endpoint: LLMEndpoint):
+        # Место на бэкенде занято с запуска; без ответа (ошибка, отмена) оно освобождается сразу,
+        # а полученный ответ держит его, пока его не закроют
+        if task.cancelled() or task.exception() is not None:
+            self._free(endpoint)
+
+    def _discard(self, task: asyncio.Task, endpoint: LLMEndpoint):
+        # Проигравший или упавший запрос: отменяем/закрываем ответ и освобождаем бэкенд
+        if not task.done():
+            task.cancel()
+            task.add_done_callback(lambda t: self._discard(t, endpoint))
+            return
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._discard_response(task.result(), endpoint)
+
+    @asynccontextmanager
+    async def post(self, payload: dict, headers: dict):
+        """
+        Отправляет запрос на лучший бэкенд и отдаёт ответ победителя.
+        Ошибки соединения и 5xx ведут к повтору на следующем бэкенде.
+        """
+        tried: list[LLMEndpoint] = []
+        tasks: dict[asyncio.Task, LLMEndpoint] = {}
+        winner: tuple[aiohttp.ClientResponse, LLMEndpoint] | None = None
+        last_error: BaseException | None = None
+        fallback: tuple[aiohttp.ClientResponse, LLMEndpoint] | None = None
+
+        def launch(endpoint: LLMEndpoint | None = None) -> bool:
+            endpoint = endpoint or self.pick(exclude=tuple(tried))
+            if endpoint is None:
+                return False
+            tried.append(endpoint)
+            endpoint.stats.outstanding += 1
+            task = asyncio.create_task(self._open(endpoint, payload, headers))
+            task.add_done_callback(lambda t: self._settle(t, endpoint))
+            tasks[task] = endpoint
+            return True
+
+        launch(await self._wait_endpoint())
+        try:
+            while tasks and winner is None:
+                hedge_delay = None
+                if self.hedge and len(tasks) == 1 and len(tried) < len(self.endpoints):
+                    hedge_delay = tried[-1].stats.percentile(0.95)
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Дубль идёт только на бэкенд со свободным местом, иначе ждём дальше
+                    slow = tried[-1]
+                    if launch():
+                        logger.info(f"LLM hedge: {slow.base_url} slower than p95 ({hedge_delay:.2f}s)")
+                    continue
+
+                for task in done:
+                    endpoint = tasks.pop(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        endpoint.stats.record_failure()
+                        logger.warning(f"LLM endpoint {endpoint.base_url} failed: {last_error!r}")
+                        continue
+                    resp = task.result()
+                    if resp.status >= 500:
+                        # Запоминаем ответ на случай, если и остальные не справятся
+                        if fallback:
+                            self._discard_response(*fallback)
+                        fallback = (resp, endpoint)
+                        continue
+                    if winner is None:
+                        winner = (resp, endpoint)
+                    else:
+                        self._discard_response(resp, endpoint)
+
+                if winner is None and not tasks:
+                    launch()
+        except BaseException:
+            # Отмена вызывающего (или ошибка) посреди гонки: уже полученные ответы тоже закрываем
+            for held in (fallback, winner):
+                if held:
+                    self._discard_response(*held)
+            raise
+        finally:
+            for task, endpoint in tasks.items():
+                self._discard(task, endpoint)
+
+        if winner is None:
+            if fallback is None:
+                raise last_error or aiohttp.ClientError("No LLM endpoints available")
+            winner = fallback
+        elif fallback:
+            self._discard_response(*fallback)
+
+        resp, endpoint = winner
+        try:
+            yield resp
+        finally:
+            self._discard_response(resp, endpoint)
+
+    def _discard_response(self, resp: aiohttp.ClientResponse, endpoint: LLMEndpoint):
+        resp.release()
+        self._free(endpoint)
+
+    async def warmup(self, payloads: list[dict], headers: dict) -> int:
+        """Шлёт payloads на каждый бэкенд напрямую, минуя балансировку. Возвращает число готовых бэкендов."""
+        async def warm(endpoint: LLMEndpoint) -> bool:
+            for payload in payloads:
+                try:
+                    started = time.monotonic()
+                    async with http_client.session.post(endpoint.url, json=payload, headers=headers,
+                                                        timeout=http_client.timeout("llm")) as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            logger.warning(f"LLM warm-up {endpoint.base_url}: HTTP {resp.status}")
+                            return False
+                    logger.info(f"LLM warm-up {endpoint.base_url}: {time.monotonic() - started:.1f}s")
+                except Exception as e:
+                    logger.warning(f"LLM warm-up {endpoint.base_url} failed: {e!r}")
+                    return False
+            return True
+
+        results = await asyncio.gather(*(warm(endpoint) for endpoint in self.endpoints))
+        return sum(results)
+
+    async def test_connection(self) -> bool:
+        for endpoint in self.endpoints:
+            try:
+                async with http_client.session.get(f"{endpoint.base_url}/models",
+                                                   timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                    if resp.status == 200:
+                        return True
+            except Exception as e:
+                logger.debug(f"LLM health check failed for {endpoint.base_url}: {e}")
+        return False
+
+
+llm_router = LLMRouter()
@@ -0,0 +1,193 @@
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from config import LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_ENDPOINTS, LLM_GUILD_WEIGHTS, LLM_USER_WEIGHTS
+from core.logger import logger
+
+# Приоритеты: чем меньше число, тем раньше обслуживается
+PRIORITY_INTERACTIVE = 0   # /ask, /ask_helpful
+PRIORITY_BACKGROUND = 1    # улучшение промптов и прочие подзапросы
+
+
+class QueueFullError(Exception):
+    """Очередь к LLM переполнена; position — место, которое досталось бы запросу."""
+
+    def __init__(self, position: int):
+        super().__init__(f"LLM queue is full (position {position})")
+        self.position = position
+
+
+class _Request:
+    __slots__ = ("priority", "guild", "user", "guild_weight", "user_weight", "seq", "fut")
+
+    def __init__(self, priority: int, guild: str, user: int, guild_weight: float, user_weight: float,
+                 seq: int, fut: asyncio.Future | None):
+        self.priority = priority
+        self.guild = guild
+        self.user = user
+        self.guild_weight = guild_weight
+        self.user_weight = user_weight
+        self.seq = seq
+        self.fut = fut
+
+
+class LLMScheduler:
+    """
+    Очередь запросов к LLM с ограничением параллельности.
+    Внутри одного приоритета работает иерархическая взвешенная справедливая очередь (WFQ):
+    сначала выбирается сервер с наименьшим виртуальным временем, затем внутри него —
+    пользователь с наименьшим своим. Каждый обслуженный запрос двигает время сервера
+    на 1/вес сервера, а время пользователя — на 1/вес пользователя. Поэтому один спамер
+    не отнимает бэкенд ни у других серверов, ни у соседей по своему серверу.
+    Личные сообщения (без сервера) — отдельный «сервер» на каждого пользователя.
+    При переполнении очереди запрос сразу отклоняется (QueueFullError).
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 guild_weights: dict[int, float] = LLM_GUILD_WEIGHTS,
+                 user_weights: dict[int, float] = LLM_USER_WEIGHTS):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.guild_weights = guild_weights
+        self.user_weights = user_weights
+        self.active = 0
+        self.waiting = 0
+        # приоритет -> сервер -> пользователь -> запросы по порядку прихода
+        self._queues: dict[int, dict[str, dict[int, list[_Request]]]] = {}
+        self._seq = itertools.count()
+        self._vtime: dict = {}                 # поток ("guild:<id>" или (сервер, user_id)) -> время следующего запроса
+        self._clock = 0.0                      # виртуальное время уровня серверов
+        self._inner: dict[str, float] = {}     # виртуальное время пользователей внутри сервера
+        self._pending: dict = {}               # поток -> запросов в очереди
+
+    def _request(self, user_id: int, guild_id: int | None, priority: int, fut: asyncio.Future | None) -> _Request:
+        guild = f"guild:{guild_id}" if guild_id is not None else f"dm:{user_id}"
+        guild_weight = self.guild_weights.get(guild_id, 1.0) if guild_id is not None else 1.0
+        return _Request(priority, guild, user_id, guild_weight, self.user_weights.get(user_id, 1.0),
+                        next(self._seq), fut)
+
+    def _activate(self, request: _Request):
+        # Поток, который простаивал, начинает с текущего времени — простой не копится в запас
+        user_flow = (request.guild, request.user)
+        if not self._pending.get(request.guild):
+            self._vtime[request.guild] = max(self._vtime.get(request.guild, 0.0), self._clock)
+        if not self._pending.get(user_flow):
+            self._vtime[user_flow] = max(self._vtime.get(user_flow, 0.0), self._inner.get(request.guild, 0.0))
+
+    def _charge(self, request: _Request):
+        user_flow = (request.guild, request.user)
+        self._clock = max(self._clock, self._vtime[request.guild])
+        self._inner[request.guild] = max(self._inner.get(request.guild, 0.0), self._vtime[user_flow])
+        self._vtime[request.guild] += 1.0 / request.guild_weight
+        self._vtime[user_flow] += 1.0 / request.user_weight
+        if len(self._vtime) > 1000:
+            self._forget_idle()
+
+    def _forget_idle(self):
+        # Простаивающий поток с временем не больше текущего восстановится тем же значением
+        self._vtime = {
+            flow: t for flow, t in self._vtime.items()
+            if self._pending.get(flow) or t > (self._inner.get(flow[0], 0.0) if isinstance(flow, tuple) else self._clock)
+        }
+        guilds = {flow[0] for flow in self._vtime if isinstance(flow, tuple)}
+        self._inner = {guild: t for guild, t in self._inner.items() if guild in guilds}
+
+    @staticmethod
+    def _pick(queues: dict[int, dict[str, dict[int, list[_Request]]]], vtime: dict) -> _Request | None:
+        for priority in sorted(queues):
+            guilds = queues[priority]
+            if not guilds:
+                continue
+            guild = min(guilds, key=lambda g: (vtime[g], min(q[0].seq for q in guilds[g].values())))
+            users = guilds[guild]
+            user = min(users, key=lambda u: (vtime[(guild, u)], users[u][0].seq))
+            return users[user][0]
+        return None
+
+    @staticmethod
+    def _remove(queues: dict[int, dict[str, dict[int, list[_Request]]]], request: _Request):
+        guilds = queues[request.priority]
+        users = guilds[request.guild]
+        users[request.user].remove(request)
+        if not users[request.user]:
+            del users[request.user]
+            if not users:
+                del guilds[request.guild]
+
+    def _enqueue(self, request: _Request):
+        self._activate(request)
+        guilds = self._queues.setdefault(request.priority, {})
+        guilds.setdefault(request.guild, {}).setdefault(request.user, []).append(request)
+        for flow in (request.guild, (request.guild, request.user)):
+            self._pending[flow] = self._pending.get(flow, 0) + 1
+        self.waiting += 1
+
+    def _dequeue(self, request: _Request):
+        self._remove(self._queues, request)
+        for flow in (request.guild, (request.guild, request.user)):
+            self._pending[flow] -= 1
+            if not self._pending[flow]:
+                del self._pending[flow]
+        self.waiting -= 1
+
+    def order(self) -> list[_Request]:
+        """Ожидающие запросы в том порядке, в каком их обслужит очередь (если новых не придёт)."""
+        queues = {p: {g: {u: list(q) for u, q in users.items()} for g, users in guilds.items()}
+                  for p, guilds in self._queues.items()}
+        vtime = dict(self._vtime)
+        result = []
+        while (request := self._pick(queues, vtime)) is not None:
+            result.append(request)
+            self._remove(queues, request)
+            vtime[request.guild] += 1.0 / request.guild_weight
+            vtime[(request.guild, request.user)] += 1.0 / request.user_weight
+        return result
+
+    async def acquire(self, user_id: int, guild_id: int | None = None, priority: int = PRIORITY_INTERACTIVE):
+        if self.active < self.max_concurrency and not self.waiting:
+            request = self._request(user_id, guild_id, priority, None)
+            self._activate(request)
+            self._charge(request)
+            self.active += 1
+            return
+
+        if self.waiting >= self.max_queue:
+            position = self.waiting + 1
+            logger.warning(f"LLM queue full, rejecting user {user_id} (position {position})")
+            raise QueueFullError(position)
+
+        request = self._request(user_id, guild_id, priority, asyncio.get_running_loop().create_future())
+        self._enqueue(request)
+        logger.info(f"LLM request queued for user {user_id}: position {self.order().index(request) + 1}")
+        try:
+            await request.fut
+        except asyncio.CancelledError:
+            if not request.fut.cancelled():
+                # Слот достался нам прямо перед отменой — возвращаем его
+                self.release()
+            elif request in self._queues.get(priority, {}).get(request.guild, {}).get(user_id, ()):
+                self._dequeue(request)
+            raise
+
+    def release(self):
+        # Слот передаётся следующему запросу, счётчик active не меняется
+        while (request := self._pick(self._queues, self._vtime)) is not None:
+            self._dequeue(request)
+            if request.fut.done():
+                continue  # запрос отменён, но ещё не успел убрать себя из очереди
+            self._charge(request)
+            request.fut.set_result(None)
+            return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, guild_id: int | None = None, priority: int = PRIORITY_INTERACTIVE):
+        await self.acquire(user_id, guild_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# Очередь пропускает не больше, чем суммарно вмещают бэкенды; лимит каждого бэкенда держит роутер
+llm_scheduler = LLMScheduler(max_concurrency=LLM_MAX_CONCURRENCY * len(LLM_ENDPOINTS))
@@ -0,0 +1,49 @@
+from typing import Awaitable, Callable
+from config import ENHANCE_CACHE_TTL
+from constants import ENHANCE_PROMPTS
+from services.ai_client import AIClient
+from services.llm_scheduler import PRIORITY_BACKGROUND
+from utils.artifact_store import request_key
+from utils.cache import response_cache
+from utils.persistent_cache import llm_disk_cache
+from utils.prompt_index import normalize_prompt
+from utils.singleflight import inflight
+from core.logger import logger
+
+
+class PromptEnhancer:
+    """
+    Превращает короткую идею в подробный промпт для генерации (target: image или video).
+    Результат не зависит от пользователя, поэтому кэшируется по нормализованной идее
+    и цели сразу для всех — «кот в космосе» улучшается один раз.
+    """
+
+    def __init__(self, ai_client: AIClient):
+        self.ai_client = ai_client
+
+    async def enhance(self, idea: str, target: str, user_id: int, guild_id: int | None = None,
+                      on_partial: Callable[[str], Awaitable[None]] | None = None) -> str | None:
+        """
+        Улучшенный промпт или None, если AI недоступен.
+        С on_partial текст приходит потоком; при одновременных одинаковых запросах
+        поток видит только первый из них, остальные получают готовый результат.
+        """
+        cache_key = "enhance:" + request_key(kind="enhance", target=target, idea=normalize_prompt(idea))
+        if cached := response_cache.get(cache_key) or await llm_disk_cache.get(cache_key):
+            logger.info(f"Enhanced prompt cache hit ({target})")
+            response_cache.set(cache_key, cached, ttl=ENHANCE_CACHE_TTL)
+            return cached
+
+        return await inflight.do(cache_key, lambda: self._enhance(idea, target, user_id, guild_id, cache_key, on_partial))
+
+    async def _enhance(self, idea: str, target: str, user_id: int, guild_id: int | None, cache_key: str,
+                       on_partial: Callable[[str], Awaitable[None]] | None) -> str | None:
+        prompt = ENHANCE_PROMPTS[target].format(idea=idea)
+        enhanced = await self.ai_client.chat([{"role": "user", "content": prompt}], user_id, guild_id,
+                                             priority=PRIORITY_BACKGROUND, on_partial=on_partial)
+        if not enhanced:
+            return None
+        enhanced = enhanced.strip().strip('"')
+        response_cache.set(cache_key, enhanced, ttl=ENHANCE_CACHE_TTL)
+        await llm_disk_cache.set(cache_key, enhanced, ENHANCE_CACHE_TTL)
+        return enhanced
@@ -0,0 +1,56 @@
+import asyncio
+from config import TTS_PREFETCH_CONCURRENCY, TTS_PREFETCH_WORKERS, TTS_DISK_CACHE
+from services.tts_service import TTSService, TTSTooLargeError
+from core.logger import logger
+
+
+class TTSPrefetcher:
+    """
+    Фоновая озвучка свежих ответов AI, чтобы /tts_chat отдавал готовый файл из кэша.
+    Включается для отдельных серверов. Одновременно идёт не больше concurrency задач,
+    их куски занимают не больше TTS_PREFETCH_WORKERS слотов синтеза (остальные — для запросов
+    пользователей), а новый ответ в канале отменяет ещё не законченную озвучку предыдущего.
+    """
+
+    def __init__(self, tts_service: TTSService, concurrency: int = TTS_PREFETCH_CONCURRENCY):
+        self.tts_service = tts_service
+        self.enabled: set[int] = set()          # guild_id
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: dict[int, asyncio.Task] = {}  # channel_id -> задача
+        self.started = 0
+        self.cancelled = 0
+
+    @property
+    def available(self) -> bool:
+        # Без дискового кэша или свободного от пользователей слота синтеза озвучивать заранее некуда
+        return TTS_PREFETCH_WORKERS > 0 and TTS_DISK_CACHE and self.tts_service.available
+
+    def schedule(self, guild_id: int | None, channel_id: int, text: str, max_bytes: int):
+        if guild_id not in self.enabled or not self.available:
+            return
+        previous = self._tasks.get(channel_id)
+        if previous and not previous.done():
+            # Ответ устарел — его озвучку вряд ли попросят
+            previous.cancel()
+            self.cancelled += 1
+        task = asyncio.create_task(self._run(text, max_bytes))
+        self._tasks[channel_id] = task
+        task.add_done_callback(lambda t: self._forget(channel_id, t))
+
+    def _forget(self, channel_id: int, task: asyncio.Task):
+        if self._tasks.get(channel_id) is task:
+            del self._tasks[channel_id]
+
+    async def _run(self, text: str, max_bytes: int):
+        async with self._slots:
+            self.started += 1
+            try:
+                # max_bytes как у /tts_chat, чтобы одновременный запрос пользователя присоединился к этой задаче
+                await self.tts_service.generate(text, 0, preset="normal", max_bytes=max_bytes, background=True)
+            except TTSTooLargeError:
+                pass
+            except Exception as e:
+                logger.warning(f"TTS prefetch failed: {e}")
+
+
+tts_prefetcher = TTSPrefetcher(TTSService())
@@ -1,12 +1,82 @@
 import edge_tts
 import asyncio
+import contextlib
+import io
 import os
-import uuid
+import re
 from core.logger import logger
-from config import TTS_CACHE_DIR
+from utils.artifact_store import audio_store, request_key
+from utils.cache import tts_cache
+from utils.singleflight import inflight
+from config import (TTS_CACHE_DIR, TTS_CHUNK_CHARS, TTS_WORKERS, TTS_CHUNK_RETRIES, TTS_CHUNK_TIMEOUT,
+                    TTS_DISK_CACHE, TTS_PREFETCH_WORKERS)
 
 os.makedirs(TTS_CACHE_DIR, exist_ok=True)
 
+_SENTENCE_END = re.compile(r"(?<=[.!?…;])\s+|\n+")
+
+# Общий лимит одновременных соединений с edge-tts на весь бот
+_workers = asyncio.Semaphore(TTS_WORKERS)
+# Фоновая озвучка занимает не больше TTS_PREFETCH_WORKERS из них
+_background_workers = asyncio.Semaphore(TTS_PREFETCH_WORKERS)
+
+# Лимит вложения Discord для серверов без буста
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+# Ссылки на фоновые записи в кэш, чтобы задачи не собрал GC
+_background: set[asyncio.Task] = set()
+
+
+class TTSTooLargeError(Exception):
+    """Аудио не влезает в лимит вложения — синтез остановлен на ходу."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"audio exceeds {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+class _SizeGuard:
+    """Общий счётчик байт для параллельно синтезируемых кусков."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+
+    def add(self, size: int):
+        self.used += size
+        if self.used > self.max_bytes:
+            raise TTSTooLargeError(self.max_bytes)
+
+
+def split_text(text: str, max_chars: int = TTS_CHUNK_CHARS) -> list[str]:
+    """
+    Режет текст на куски не длиннее max_chars по границам предложений.
+    Короткие предложения склеиваются, слишком длинные режутся по словам.
+    """
+    chunks: list[str] = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
 class TTSService:
     def __init__(self):
         self.available = True
@@ -17,40 +87,148 @@ class TTSService:
             logger.warning("edge-tts не установлен. Установи: pip install edge-tts")
             self.available = False
 
-    async def generate(self, text: str, user_id: int, preset: str = "normal") -> str | None:
+    async def generate(self, text: str, user_id: int, preset: str = "normal", pitch: str = "+0Hz",
+                       max_bytes: int = DEFAULT_MAX_BYTES, background: bool = False) -> str | io.BytesIO | None:
+        """
+        Озвучивает текст и возвращает то, что можно сразу отдать в discord.File:
+        путь к MP3 из кэша или буфер в памяти со свежим аудио.
+        Свежее аудио на диск пишется только при включённом TTS_DISK_CACHE (в фоне, не задерживая ответ).
+        Если аудио перерастает max_bytes, синтез обрывается и бросается TTSTooLargeError.
+        Файл из кэша удалять после отправки не нужно.
+        background=True — фоновая озвучка: куски синтезируются в урезанном лимите TTS_PREFETCH_WORKERS.
+        """
         if not self.available:
             return None
 
+        # Выбор голоса в зависимости от пресета
+        voice_map = {
+            "normal": "ru-RU-SvetlanaNeural",   # Приятный женский русский
+            "fast": "ru-RU-DmitryNeural",       # Мужской, чуть быстрее
+            "calm": "ru-RU-SvetlanaNeural"      # Тот же спокойный
+        }
+        voice = voice_map.get(preset, "ru-RU-SvetlanaNeural")
+
+        # Параметры скорости
+        rate_map = {
+            "normal": "+0%",
+            "fast": "+30%",
+            "calm": "-10%"
+        }
+        rate = rate_map.get(preset, "+0%")
+
+        cache_key = request_key(kind="tts", text=text, voice=voice, rate=rate, pitch=pitch)
+        if TTS_DISK_CACHE:
+            cached = tts_cache.get(cache_key)
+            if cached and not os.path.exists(cached):
+                # Хранилище вытеснило файл — запись в памяти устарела
+                tts_cache.delete(cache_key)
+                cached = None
+            cached = cached or await audio_store.get(cache_key)
+            if cached and os.path.getsize(cached) <= max_bytes:
+                logger.info(f"TTS cache hit (голос: {voice}, rate: {rate})")
+                tts_cache.set(cache_key, cached)
+                return cached
+
+        # Одинаковый текст тем же голосом озвучивается один раз, даже если просят одновременно
+        audio = await inflight.do(f"tts:{cache_key}:{max_bytes}",
+                                  lambda: self._synthesize(text, voice, rate, pitch, cache_key, max_bytes, background))
+        if audio is None:
+            return None
+        # У каждого ожидающего свой буфер: discord.File читает и закрывает его
+        return io.BytesIO(audio)
+
+    async def _store(self, cache_key: str, audio: bytes):
         try:
-            # Выбор голоса в зависимости от пресета
-            voice_map = {
-                "normal": "ru-RU-SvetlanaNeural",   # Приятный женский русский
-                "fast": "ru-RU-DmitryNeural",       # Мужской, чуть быстрее
-                "calm": "ru-RU-SvetlanaNeural"      # Тот же спокойный
-            }
-            voice = voice_map.get(preset, "ru-RU-SvetlanaNeural")
-
-            # Параметры скорости
-            rate_map = {
-                "normal": "+0%",
-                "fast": "+30%",
-                "calm": "-10%"
-            }
-            rate = rate_map.get(preset, "+0%")
-
-            filename = f"tts_{user_id}_{uuid.uuid4().hex[:8]}.mp3"
-            filepath = os.path.join(TTS_CACHE_DIR, filename)
-
-            communicate = edge_tts.Communicate(text, voice, rate=rate)
-            await communicate.save(filepath)
-
-            if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-                logger.info(f"TTS сгенерирован: {filepath} (голос: {voice}, rate: {rate})")
-                return filepath
-            else:
-                logger.error("TTS файл пустой или не создан")
+            filepath = await audio_store.put_bytes(cache_key, audio, ".mp3")
+            tts_cache.set(cache_key, filepath)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить TTS в кэш: {e}")
+
+    async def _synthesize_chunk(self, text: str, voice: str, rate: str, pitch: str, guard: _SizeGuard,
+                                background: bool = False) -> bytes:
+        """Один кусок текста -> байты MP3 (не больше TTS_WORKERS кусков одновременно)."""
+        async with _background_workers if background else contextlib.nullcontext(), _workers:
+            audio = bytearray()
+            communicate = edge_tts.Communicate(text, voice, rate=rate, pitch=pitch)
+
+            async def collect():
+                async for chunk in communicate.stream():
+                    if chunk["type"] == "audio":
+                        audio.extend(chunk["data"])
+                        guard.add(len(chunk["data"]))
+
+            try:
+                await asyncio.wait_for(collect(), TTS_CHUNK_TIMEOUT)
+            except TTSTooLargeError:
+                # Лимит превышен — счётчик не откатываем, остальные куски тоже должны остановиться
+                raise
+            except BaseException:
+                # Упавший кусок будет синтезирован заново — его байты не в счёт
+                guard.used -= len(audio)
+                raise
+            if not audio:
+                raise RuntimeError("edge-tts вернул пустое аудио")
+            return bytes(audio)
+
+    async def _synthesize(self, text: str, voice: str, rate: str, pitch: str, cache_key: str,
+                          max_bytes: int, background: bool = False) -> bytes | None:
+        """
+        Текст режется по предложениям, куски озвучиваются параллельно,
+        MP3-кадры склеиваются по порядку в памяти. Повторяются только упавшие куски.
+        """
+        chunks = split_text(text)
+        if not chunks:
+            return None
+        parts: list[bytes | None] = [None] * len(chunks)
+        guard = _SizeGuard(max_bytes)
+
+        try:
+            for attempt in range(TTS_CHUNK_RETRIES + 1):
+                pending = [i for i, part in enumerate(parts) if part is None]
+                if not pending:
+                    break
+                if attempt:
+                    logger.warning(f"TTS: повтор {len(pending)} из {len(chunks)} кусков (попытка {attempt + 1})")
+                async def attempt_chunk(i: int):
+                    # Обычная ошибка куска — повод повторить его; превышение лимита обрывает весь синтез
+                    try:
+                        return await self._synthesize_chunk(chunks[i], voice, rate, pitch, guard, background)
+                    except TTSTooLargeError:
+                        raise
+                    except Exception as e:
+                        return e
+
+                tasks = [asyncio.create_task(attempt_chunk(i)) for i in pending]
+                try:
+                    results = await asyncio.gather(*tasks)
+                except TTSTooLargeError:
+                    # Остальные куски (и ждущие слота) отменяются сразу
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    logger.warning(f"TTS: аудио больше {max_bytes} байт, синтез остановлен")
+                    raise
+                for i, result in zip(pending, results):
+                    if isinstance(result, BaseException):
+                        logger.error(f"Ошибка TTS куска {i + 1}/{len(chunks)}: {result!r}")
+                    else:
+                        parts[i] = result
+
+            if any(part is None for part in parts):
+                logger.error(f"TTS: не удалось озвучить {parts.count(None)} из {len(chunks)} кусков")
                 return None
 
+            # Выход edge-tts — голые MP3-кадры без заголовков, поэтому склейка байт даёт валидный файл
+            audio = b"".join(parts)
+            if TTS_DISK_CACHE:
+                task = asyncio.create_task(self._store(cache_key, audio))
+                _background.add(task)
+                task.add_done_callback(_background.discard)
+            logger.info(f"TTS сгенерирован: {len(audio)} байт (голос: {voice}, rate: {rate}, кусков: {len(chunks)})")
+            return audio
+
+        except TTSTooLargeError:
+            raise
         except Exception as e:
             logger.error(f"Ошибка TTS: {e}")
             return None
\ No newline at end of file
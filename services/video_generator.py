@@ -1,48 +1,73 @@
 import aiohttp
 import asyncio
 import os
+import time
 import uuid
-from config import POLLO_API_KEY, GENERATED_VIDEOS_DIR, POLLO_BASE_URL
-from utils.cache import image_cache  # или video_cache
+from config import (POLLO_API_KEY, GENERATED_VIDEOS_DIR, POLLO_BASE_URL, POLLO_TASKS_URL,
+                    VIDEO_EXPECTED_SECONDS, VIDEO_POLL_MIN, VIDEO_POLL_MAX, VIDEO_TIMEOUT,
+                    VIDEO_DOWNLOAD_PARTS, VIDEO_DOWNLOAD_MIN_PART_MB)
+from utils.cache import video_cache, NEGATIVE
+from utils.artifact_store import video_store, request_key
+from utils.poll_schedule import CompletionStats, poll_delays
+from core.http import http_client
+from core.webhooks import webhook_server
 from core.logger import logger
 
+# Сколько рендерятся ролики по (длина, формат) — общая история для всех генераторов
+completion_stats = CompletionStats(VIDEO_EXPECTED_SECONDS)
+
+ALLOWED_LENGTHS = {4, 8, 12}
+
+
+def stats_key(length: int, aspect_ratio: str) -> str:
+    return f"{length}:{aspect_ratio}"
+
+
 class VideoGenerator:
     def __init__(self):
         self.api_key = POLLO_API_KEY
         self.base_url = POLLO_BASE_URL  # https://pollo.ai/api/platform/generation/sora/sora-2
-        self.tasks_url = "https://pollo.ai/api/platform/tasks/"  # для polling статуса
+        self.tasks_url = POLLO_TASKS_URL  # для polling статуса
+        self.headers = {
+            "x-api-key": self.api_key,
+            "Content-Type": "application/json"
+        }
         self.available = bool(self.api_key)
         if not self.available:
             logger.warning("Pollo.ai API key not set — video generation disabled")
 
-    async def generate(self, prompt: str, user_id: int, image_url: str | None = None,
-                       length: int = 8, aspect_ratio: str = "16:9") -> str | None:
-        """
-        Асинхронная генерация видео Sora 2 через Pollo.ai с polling.
-        length: только 4, 8 или 12 секунд
-        """
-        if not self.available:
-            return None
-
-        # Валидация length
-        ALLOWED_LENGTHS = {4, 8, 12}
+    @staticmethod
+    def normalize_length(length: int) -> int:
+        """Sora 2 умеет только 4, 8 или 12 секунд — берём ближайшую."""
         if length not in ALLOWED_LENGTHS:
-            length = min(ALLOWED_LENGTHS, key=lambda x: abs(x - length))
-            logger.warning(f"Invalid length {length} → fallback to {length}s for Sora 2")
-
-        # Кэш (учитываем image_url если есть)
-        image_part = f":img:{hash(image_url)}" if image_url else ""
-        cache_key = f"vid:sora2:{user_id}:{hash(prompt)}:{length}:{aspect_ratio}{image_part}"
-
-        if cached := image_cache.get(cache_key):
-            logger.info(f"Sora 2 cache hit for user {user_id}")
+            fixed = min(ALLOWED_LENGTHS, key=lambda x: abs(x - length))
+            logger.warning(f"Invalid length {length} → fallback to {fixed}s for Sora 2")
+            return fixed
+        return length
+
+    @staticmethod
+    def job_key(prompt: str, length: int, aspect_ratio: str, image_url: str | None) -> str:
+        # Кэш по стабильному хэшу параметров (учитываем image_url если есть)
+        return request_key(kind="sora2", prompt=prompt, length=length,
+                           aspect_ratio=aspect_ratio, image_url=image_url)
+
+    async def cached(self, cache_key: str):
+        """Путь к готовому ролику, NEGATIVE (недавний отказ API) или None."""
+        cached = video_cache.get(cache_key)
+        if cached is NEGATIVE:
+            return NEGATIVE
+        if cached and not os.path.exists(cached):
+            # Хранилище вытеснило файл — запись в памяти устарела
+            video_cache.delete(cache_key)
+            cached = None
+        if cached or (cached := await video_store.get(cache_key)):
+            video_cache.set(cache_key, cached)
             return cached
+        return None
 
-        headers = {
-            "x-api-key": self.api_key,
-            "Content-Type": "application/json"
-        }
-
+    async def submit(self, prompt: str, length: int, aspect_ratio: str, image_url: str | None,
+                     cache_key: str) -> str | None:
+        """Создаёт задачу в Pollo и возвращает её task id (или None)."""
         payload = {
             "input": {
                 "prompt": prompt,
@@ -54,73 +79,169 @@ class VideoGenerator:
         if image_url:
             payload["input"]["image"] = image_url
 
-        # Опционально: добавь webhook если есть публичный эндпоинт
-        # payload["webhookUrl"] = "https://your-bot.com/webhook/pollo"
-
+        # Если бот доступен снаружи, Pollo сам сообщит о готовности
+        if webhook_url := webhook_server.url("pollo"):
+            payload["webhookUrl"] = webhook_url
+
+        async with http_client.session.post(self.base_url, json=payload, headers=self.headers,
+                                            timeout=http_client.timeout("pollo")) as resp:
+            if resp.status != 200:
+                error_text = await resp.text()
+                logger.error(f"Pollo.ai create task error {resp.status}: {error_text}")
+                if 400 <= resp.status < 500:
+                    # Отказ по запросу (баланс, модерация) — не повторяем его сразу
+                    video_cache.set_negative(cache_key)
+                return None
+            data = await resp.json()
+        task_id = data.get("taskId")
+        if not task_id:
+            logger.error("No taskId in response")
+            return None
+        logger.info(f"Sora 2 task created: {task_id}")
+        return task_id
+
+    async def _check(self, task_id: str) -> tuple[str | None, str | None]:
+        """Один запрос статуса: (status, video_url)."""
+        async with http_client.session.get(f"{self.tasks_url}{task_id}", headers=self.headers,
+                                           timeout=http_client.timeout("pollo")) as resp:
+            if resp.status != 200:
+                logger.error(f"Status check error {resp.status}")
+                return None, None
+            data = await resp.json()
+        status = data.get("status")
+        video_url = data.get("video_url") or data.get("output", {}).get("url")
+        return status, video_url
+
+    async def wait(self, task_id: str, length: int, aspect_ratio: str, submitted_at: float | None = None) -> str | None:
+        """
+        Ждёт завершения задачи и возвращает URL видео.
+        Первая проверка — не раньше, чем такие ролики обычно бывают готовы (по истории),
+        дальше пауза растёт экспоненциально со случайным разбросом.
+        Если пришёл вебхук, статус проверяется сразу; при включённых вебхуках
+        опрос остаётся лишь подстраховкой и идёт с максимальной паузой.
+        submitted_at (time.time() создания задачи) нужен, когда ожидание возобновляется после рестарта.
+        """
+        key = stats_key(length, aspect_ratio)
+        started = submitted_at or time.time()
+        webhook = webhook_server.waiter(task_id) if webhook_server.enabled else None
+        # После рестарта часть ожидания уже позади
+        first = max(0.0, completion_stats.earliest(key) - (time.time() - started))
+        delays = poll_delays(first, VIDEO_POLL_MIN, VIDEO_POLL_MAX)
+        attempts = checks = 0
         try:
-            async with aiohttp.ClientSession() as session:
-                # Шаг 1: Создаём задачу
-                async with session.post(self.base_url, json=payload, headers=headers) as resp:
-                    if resp.status != 200:
-                        error_text = await resp.text()
-                        logger.error(f"Pollo.ai create task error {resp.status}: {error_text}")
-                        return None
-                    data = await resp.json()
-                    task_id = data.get("taskId")
-                    if not task_id:
-                        logger.error("No taskId in response")
-                        return None
-                    logger.info(f"Sora 2 task created: {task_id}")
-
-                # Шаг 2: Polling статуса (max ~5 минут)
-                poll_interval = 10  # секунд между проверками
-                max_attempts = 30   # ~5 минут
-                for attempt in range(max_attempts):
-                    await asyncio.sleep(poll_interval)
-
-                    async with session.get(f"{self.tasks_url}{task_id}", headers=headers) as status_resp:
-                        if status_resp.status != 200:
-                            logger.error(f"Status check error {status_resp.status}")
-                            continue
-                        status_data = await status_resp.json()
-
-                        status = status_data.get("status")
-                        logger.info(f"Task {task_id} status: {status}")
-
-                        if status == "succeed":
-                            video_url = status_data.get("video_url") or status_data.get("output", {}).get("url")
-                            if not video_url:
-                                logger.warning("No video_url in succeed response")
-                                return None
-                            break
-
-                        if status == "failed":
-                            logger.error(f"Task failed: {status_data}")
-                            return None
-
-                        # Если processing/waiting — продолжаем poll
-
+            # Хотя бы одна проверка, даже если задача пережила рестарт и таймаут уже вышел
+            while attempts == 0 or time.time() - started < VIDEO_TIMEOUT:
+                attempts += 1
+                delay = next(delays)
+                if webhook is not None:
+                    delay = max(delay, VIDEO_POLL_MAX)
+                    try:
+                        await asyncio.wait_for(asyncio.shield(webhook), delay)
+                    except asyncio.TimeoutError:
+                        pass
                 else:
-                    logger.warning(f"Task {task_id} timeout after {max_attempts * poll_interval}s")
-                    return None
-
-                # Шаг 3: Скачиваем видео
-                async with session.get(video_url) as vid_resp:
-                    if vid_resp.status != 200:
-                        logger.error(f"Video download error {vid_resp.status}")
+                    await asyncio.sleep(delay)
+
+                try:
+                    status, video_url = await self._check(task_id)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    # Сбой сети не отменяет оплаченную задачу — проверим в следующий раз
+                    logger.warning(f"Status check for {task_id} failed: {e!r}")
+                    continue
+                checks += 1
+                logger.info(f"Task {task_id} status: {status}")
+
+                if status == "succeed":
+                    if not video_url:
+                        logger.warning("No video_url in succeed response")
                         return None
+                    elapsed = time.time() - started
+                    completion_stats.record(key, elapsed)
+                    logger.info(f"Task {task_id} done in {elapsed:.0f}s after {checks} status checks")
+                    return video_url
 
-                    filename = f"sora2_{user_id}_{uuid.uuid4().hex[:8]}.mp4"
-                    filepath = os.path.join(GENERATED_VIDEOS_DIR, filename)
-
-                    with open(filepath, "wb") as f:
-                        async for chunk in vid_resp.content.iter_chunked(1024 * 1024):
-                            f.write(chunk)
+                if status == "failed":
+                    logger.error(f"Task {task_id} failed")
+                    return None
 
-                    image_cache.set(cache_key, filepath)
-                    logger.info(f"Sora 2 video saved: {filepath}")
-                    return filepath
+                # Если processing/waiting — ждём дальше; сработавший вебхук заводим заново
+                if webhook is not None and webhook.done():
+                    webhook = webhook_server.waiter(task_id)
 
+            logger.warning(f"Task {task_id} timeout after {VIDEO_TIMEOUT:.0f}s")
+            return None
+        finally:
+            if webhook is not None:
+                webhook_server.forget(task_id)
+
+    async def _probe(self, video_url: str) -> int | None:
+        """Размер файла, если сервер отдаёт его по частям (Range), иначе None."""
+        headers = {"Range": "bytes=0-0"}
+        async with http_client.session.get(video_url, headers=headers, timeout=http_client.timeout("pollo")) as resp:
+            content_range = resp.headers.get("Content-Range", "")
+            if resp.status != 206 or "/" not in content_range:
+                return None
+            total = content_range.rsplit("/", 1)[1]
+            return int(total) if total.isdigit() else None
+
+    async def _fetch(self, video_url: str, filepath: str, start: int | None = None, end: int | None = None):
+        """Качает весь файл или диапазон [start, end] в filepath; запись — в рабочем потоке."""
+        headers = {"Range": f"bytes={start}-{end}"} if start is not None else None
+        async with http_client.session.get(video_url, headers=headers,
+                                           timeout=http_client.timeout("download")) as resp:
+            if resp.status != (206 if headers else 200):
+                raise RuntimeError(f"Video download error {resp.status}")
+            f = await asyncio.to_thread(open, filepath, "r+b" if headers else "wb")
+            try:
+                if start:
+                    await asyncio.to_thread(f.seek, start)
+                async for chunk in resp.content.iter_chunked(1024 * 1024):
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+
+    async def _fetch_ranges(self, video_url: str, filepath: str, size: int):
+        part = max(int(VIDEO_DOWNLOAD_MIN_PART_MB * 1024 * 1024), -(-size // VIDEO_DOWNLOAD_PARTS))
+        ranges = [(start, min(size, start + part) - 1) for start in range(0, size, part)]
+
+        def allocate():
+            with open(filepath, "wb") as f:
+                f.truncate(size)
+
+        await asyncio.to_thread(allocate)
+
+        async def fetch_part(start: int, end: int):
+            for attempt in range(3):
+                try:
+                    return await self._fetch(video_url, filepath, start, end)
+                except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                    if attempt == 2:
+                        raise
+                    logger.warning(f"Video part {start}-{end} failed ({e!r}), retrying")
+
+        await asyncio.gather(*(fetch_part(start, end) for start, end in ranges))
+        logger.info(f"Video downloaded in {len(ranges)} parallel parts ({size} bytes)")
+
+    async def download(self, video_url: str, cache_key: str) -> str | None:
+        """
+        Скачивает готовый ролик в хранилище и возвращает путь.
+        Если сервер поддерживает Range, файл качается несколькими параллельными кусками.
+        """
+        filename = f"sora2_{uuid.uuid4().hex[:8]}.mp4"
+        filepath = os.path.join(GENERATED_VIDEOS_DIR, filename)
+        try:
+            size = await self._probe(video_url)
+            if size and size > VIDEO_DOWNLOAD_MIN_PART_MB * 1024 * 1024:
+                await self._fetch_ranges(video_url, filepath, size)
+            else:
+                await self._fetch(video_url, filepath)
         except Exception as e:
-            logger.error(f"Sora 2 exception: {e}")
-            return None
\ No newline at end of file
+            logger.error(f"Video download failed: {e}")
+            await asyncio.to_thread(lambda: os.path.exists(filepath) and os.remove(filepath))
+            return None
+
+        # Временный файл переезжает в хранилище под именем-хэшем содержимого
+        filepath = await video_store.put_file(cache_key, filepath, ".mp4")
+        video_cache.set(cache_key, filepath)
+        logger.info(f"Sora 2 video saved: {filepath}")
+        return filepath
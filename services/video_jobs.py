@@ -0,0 +1,316 @@
+import asyncio
+import os
+import threading
+import time
+import discord
+from config import VIDEO_JOBS_DB, VIDEO_WORKERS
+from core.db import connect
+from core.logger import logger
+from services.video_generator import VideoGenerator, completion_stats, stats_key
+from utils.cache import NEGATIVE
+from utils.video_transcode import fit_video
+
+ACTIVE_STATES = ("queued", "submitted")
+DELIVERY_RETRY_DELAYS = (10, 30, 120, 600)  # паузы перед повторной доставкой, секунды
+
+
+class VideoJobQueue:
+    """
+    Очередь заказов видео, которая переживает и interaction, и рестарт бота.
+    Задачи лежат в SQLite: параметры, task id в Pollo, состояние
+    (queued → submitted → done/failed) и кому доставить результат.
+    Одинаковые заказы склеиваются в одну задачу, рендер идёт не больше чем в workers потоков.
+    При старте незаконченные задачи продолжаются: оплаченный task id опрашивается дальше.
+    Результат отправляется в канал от имени бота — токен interaction (15 минут) не нужен.
+    """
+
+    def __init__(self, generator: VideoGenerator, path: str = VIDEO_JOBS_DB, workers: int = VIDEO_WORKERS):
+        self.generator = generator
+        self.workers = workers
+        self.bot: discord.Client | None = None
+        self._queue: asyncio.Queue[int] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._retries: dict[int, tuple[int, asyncio.TimerHandle]] = {}  # job_id -> (попытка, таймер)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS video_jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, cache_key TEXT NOT NULL,"
+            " prompt TEXT NOT NULL, length INTEGER NOT NULL, aspect_ratio TEXT NOT NULL, image_url TEXT,"
+            " state TEXT NOT NULL, task_id TEXT, result TEXT,"
+            " created_at REAL NOT NULL, submitted_at REAL, finished_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS video_requests ("
+            " job_id INTEGER NOT NULL REFERENCES video_jobs(id), user_id INTEGER NOT NULL,"
+            " channel_id INTEGER NOT NULL, delivered INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (job_id, user_id, channel_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS video_jobs_state ON video_jobs(state, cache_key)")
+
+    # --- SQLite (вызывается из рабочих потоков) ---
+
+    def _add(self, cache_key: str, prompt: str, length: int, aspect_ratio: str, image_url: str | None,
+             user_id: int, channel_id: int) -> tuple[int, bool]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM video_jobs WHERE cache_key = ? AND state IN (?, ?) ORDER BY id LIMIT 1",
+                (cache_key, *ACTIVE_STATES)
+            ).fetchone()
+            created = row is None
+            if created:
+                job_id = self._conn.execute(
+                    "INSERT INTO video_jobs (cache_key, prompt, length, aspect_ratio, image_url, state, created_at)"
+                    " VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                    (cache_key, prompt, length, aspect_ratio, image_url, time.time())
+                ).lastrowid
+            else:
+                job_id = row[0]
+            self._conn.execute(
+                "INSERT OR IGNORE INTO video_requests (job_id, user_id, channel_id) VALUES (?, ?, ?)",
+                (job_id, user_id, channel_id)
+            )
+            return job_id, created
+
+    def _job(self, job_id: int) -> dict | None:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM video_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def _update(self, job_id: int, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE video_jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _unfinished(self) -> list[int]:
+        """Активные задачи и завершённые, результат которых ещё не доставлен."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT j.id FROM video_jobs j LEFT JOIN video_requests r ON r.job_id = j.id"
+                " WHERE j.state IN (?, ?) OR r.delivered = 0 ORDER BY j.id",
+                ACTIVE_STATES
+            ).fetchall()
+            return [job_id for job_id, in rows]
+
+    def _recipients(self, job_id: int) -> list[tuple[int, int]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT user_id, channel_id FROM video_requests WHERE job_id = ? AND delivered = 0", (job_id,)
+            ).fetchall()
+
+    def _mark_delivered(self, job_id: int, user_id: int, channel_id: int):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE video_requests SET delivered = 1 WHERE job_id = ? AND user_id = ? AND channel_id = ?",
+                (job_id, user_id, channel_id)
+            )
+
+    def _user_jobs(self, user_id: int) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT j.id, j.state, j.prompt, j.length, j.aspect_ratio, j.submitted_at,"
+                " (SELECT COUNT(*) FROM video_jobs q WHERE q.state = 'queued' AND q.id <= j.id)"
+                " FROM video_jobs j JOIN video_requests r ON r.job_id = j.id"
+                " WHERE r.user_id = ? AND j.state IN (?, ?) ORDER BY j.id",
+                (user_id, *ACTIVE_STATES)
+            ).fetchall()
+        names = ("id", "state", "prompt", "length", "aspect_ratio", "submitted_at", "position")
+        return [dict(zip(names, row)) for row in rows]
+
+    def _history(self, limit: int = 500) -> list[tuple[int, str, float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT length, aspect_ratio, finished_at - submitted_at FROM video_jobs"
+                " WHERE state = 'done' AND submitted_at IS NOT NULL ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+
+    # --- Публичный интерфейс ---
+
+    async def start(self, bot: discord.Client):
+        """Запуск воркеров и продолжение незаконченных задач (из setup_hook)."""
+        self.bot = bot
+        for length, aspect_ratio, seconds in reversed(await asyncio.to_thread(self._history)):
+            completion_stats.record(stats_key(length, aspect_ratio), seconds)
+        unfinished = await asyncio.to_thread(self._unfinished)
+        for job_id in unfinished:
+            self._queue.put_nowait(job_id)
+        if unfinished:
+            logger.info(f"Video jobs resumed: {len(unfinished)}")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        # Задачи остаются в базе и продолжатся при следующем старте
+        for _, handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, prompt: str, user_id: int, channel_id: int, image_url: str | None = None,
+                     length: int = 8, aspect_ratio: str = "16:9") -> tuple[int, int]:
+        """Ставит заказ в очередь. Возвращает (номер задачи, позиция в очереди; 0 — уже рендерится)."""
+        length = self.generator.normalize_length(length)
+        cache_key = self.generator.job_key(prompt, length, aspect_ratio, image_url)
+        job_id, created = await asyncio.to_thread(
+            self._add, cache_key, prompt, length, aspect_ratio, image_url, user_id, channel_id
+        )
+        if created:
+            self._queue.put_nowait(job_id)
+        else:
+            logger.info(f"Video job {job_id}: duplicate request from user {user_id}")
+        return job_id, await self.position(job_id, user_id)
+
+    async def cached(self, prompt: str, image_url: str | None = None, length: int = 8,
+                     aspect_ratio: str = "16:9") -> str | None:
+        """Готовый ролик для таких же параметров, как у submit, — его можно отдать сразу."""
+        length = self.generator.normalize_length(length)
+        cached = await self.generator.cached(self.generator.job_key(prompt, length, aspect_ratio, image_url))
+        return cached or None
+
+    async def position(self, job_id: int, user_id: int) -> int:
+        for job in await self.user_jobs(user_id):
+            if job["id"] == job_id:
+                return job["position"] if job["state"] == "queued" else 0
+        return 0
+
+    async def user_jobs(self, user_id: int) -> list[dict]:
+        """Активные задачи пользователя: state, позиция среди ожидающих, submitted_at."""
+        return await asyncio.to_thread(self._user_jobs, user_id)
+
+    # --- Воркеры ---
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                path = await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Video job {job_id} error: {e}")
+                path = None
+                try:
+                    await asyncio.to_thread(self._update, job_id, state="failed", finished_at=time.time())
+                except Exception as e:
+                    # Воркер должен жить дальше; задача продолжится при следующем старте
+                    logger.error(f"Video job {job_id}: failure report error: {e}")
+                    continue
+            # Ошибки доставки — отдельно от генерации: готовый ролик не превращается в failed
+            if not await self._deliver(job_id, path):
+                self._retry_delivery(job_id)
+
+    async def _run(self, job_id: int) -> str | None:
+        """Генерирует ролик (или берёт готовый результат задачи). Путь к файлу или None — провал."""
+        job = await asyncio.to_thread(self._job, job_id)
+        if job is None:
+            return None
+        if job["state"] in ACTIVE_STATES:
+            path = await self._render(job)
+            state = "done" if path else "failed"
+            await asyncio.to_thread(self._update, job_id, state=state, result=path, finished_at=time.time())
+            return path
+        return job["result"] if job["state"] == "done" else None
+
+    def _retry_delivery(self, job_id: int):
+        """Повторная доставка с растущей паузой: задача снова попадает в очередь и не рендерится заново."""
+        attempt, _ = self._retries.pop(job_id, (0, None))
+        if attempt >= len(DELIVERY_RETRY_DELAYS):
+            logger.error(f"Video job {job_id}: delivery retries exhausted, will retry on next start")
+            return
+        delay = DELIVERY_RETRY_DELAYS[attempt]
+        logger.warning(f"Video job {job_id}: delivery retry {attempt + 1} in {delay}s")
+        handle = asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job_id)
+        self._retries[job_id] = (attempt + 1, handle)
+
+    async def _render(self, job: dict) -> str | None:
+        generator = self.generator
+        cached = await generator.cached(job["cache_key"])
+        if cached is NEGATIVE:
+            return None
+        if cached:
+            return cached
+
+        task_id = job["task_id"]
+        if task_id is None:
+            task_id = await generator.submit(job["prompt"], job["length"], job["aspect_ratio"],
+                                             job["image_url"], job["cache_key"])
+            if not task_id:
+                return None
+            job["submitted_at"] = time.time()
+            # task id сохраняется сразу: после рестарта оплаченная задача не потеряется
+            await asyncio.to_thread(self._update, job["id"], state="submitted", task_id=task_id,
+                                    submitted_at=job["submitted_at"])
+        else:
+            logger.info(f"Video job {job['id']}: resuming task {task_id}")
+
+        video_url = await generator.wait(task_id, job["length"], job["aspect_ratio"], job["submitted_at"])
+        if not video_url:
+            return None
+        return await generator.download(video_url, job["cache_key"])
+
+    async def _channel(self, channel_id: int):
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            channel = await self.bot.fetch_channel(channel_id)
+        return channel
+
+    async def _deliver(self, job_id: int, path: str | None) -> bool:
+        """Рассылает результат. False — кому-то не доставлено из-за временной ошибки, стоит повторить."""
+        await self.bot.wait_until_ready()
+        delivered = True
+        try:
+            recipients = await asyncio.to_thread(self._recipients, job_id)
+        except Exception as e:
+            logger.error(f"Video job {job_id}: recipients error: {e}")
+            return False
+        for user_id, channel_id in recipients:
+            try:
+                channel = await self._channel(channel_id)
+                await channel.send(**await video_message(channel, user_id, job_id, path))
+            except asyncio.CancelledError:
+                raise
+            except discord.HTTPException as e:
+                logger.error(f"Video job {job_id}: delivery to {channel_id} failed: {e}")
+                if e.status != 403 and e.status != 404:
+                    delivered = False  # временная ошибка — повторим позже
+                    continue
+            except Exception as e:
+                logger.error(f"Video job {job_id}: delivery to {channel_id} failed: {e}")
+                delivered = False
+                continue
+            try:
+                await asyncio.to_thread(self._mark_delivered, job_id, user_id, channel_id)
+            except Exception as e:
+                logger.error(f"Video job {job_id}: mark delivered error: {e}")
+        if delivered:
+            self._retries.pop(job_id, None)
+        return delivered
+
+
+async def video_message(channel, user_id: int, job_id: int, path: str | None) -> dict:
+    """Аргументы channel.send с готовым роликом (пережатым под лимит сервера) или сообщением об ошибке."""
+    mention = f"<@{user_id}>"
+    if not path or not os.path.exists(path):
+        return {"content": mention, "embed": discord.Embed(
+            title=f"❌ Ошибка генерации видео #{job_id}",
+            description="Попробуй позже или упрости промпт.", color=0xe74c3c)}
+
+    limit = channel.guild.filesize_limit if getattr(channel, "guild", None) else discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+    fitted = await fit_video(path, limit)
+    if not fitted:
+        file_size = os.path.getsize(path)
+        return {"content": mention, "embed": discord.Embed(
+            title=f"❌ Видео #{job_id} слишком большое ({file_size / (1024 * 1024):.1f} MB)", color=0xe74c3c)}
+    path = fitted
+
+    embed = discord.Embed(title=f"🎬 Видео #{job_id} готово!", color=0x2ecc71)
+    return {"content": mention, "embed": embed, "file": discord.File(path, filename="video.mp4")}
+
+
+video_jobs = VideoJobQueue(VideoGenerator())
@@ -1,8 +1,60 @@
 import aiohttp
+import asyncio
 import json
+import time
+import unicodedata
 from typing import Optional, List, Dict, Any
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlsplit, urlunsplit, parse_qsl
+from config import (SEARCH_CACHE_TTL, SEARCH_STALE_FACTOR, SEARXNG_INSTANCES,
+                    SEARCH_HEDGE_DELAY, SEARCH_HEDGE_MAX, SEARCH_EJECT_SECONDS)
+from core.http import http_client
 from core.logger import logger
+from utils.artifact_store import request_key
+from utils.cache import search_cache
+from utils.endpoint_stats import EndpointStats
+from utils.singleflight import inflight
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and Unicode forms do not change the query (punctuation does: "c++", quotes)."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+_TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "yclid", "ref_src")
+
+
+def canonical_url(url: str) -> str:
+    """Same page despite scheme, www., trailing slash, fragment or tracking parameters."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower().removeprefix("www.")
+    query = urlencode(sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not name.lower().startswith(_TRACKING_PARAMS)
+    ))
+    return urlunsplit(("", host, parts.path.rstrip("/"), query, ""))
+
+
+# Scoreboard shared by all WebSearchService objects: EWMA latency, success rate, circuit breaker
+_scoreboard: Dict[str, EndpointStats] = {}
+
+
+def _instance_stats(instance: str) -> EndpointStats:
+    stats = _scoreboard.get(instance)
+    if stats is None:
+        stats = _scoreboard[instance] = EndpointStats(instance, eject_after=2, eject_base=SEARCH_EJECT_SECONDS)
+    return stats
+
+
+def search_scoreboard() -> List[Dict[str, Any]]:
+    """Instance health for diagnostics."""
+    return [{
+        "instance": instance,
+        "state": stats.state,
+        "latency": stats.latency,
+        "success_rate": stats.success_rate,
+        "outstanding": stats.outstanding,
+    } for instance, stats in _scoreboard.items()]
+
 
 class WebSearchService:
     def __init__(self, searxng_instance_url: str = "https://searx.space"):
@@ -17,8 +69,10 @@ class WebSearchService:
         """
         self.instance_url = searxng_instance_url.rstrip('/')
         self.search_endpoint = f"{self.instance_url}/search"
+        self.instances = [self.instance_url] + [url for url in SEARXNG_INSTANCES if url != self.instance_url]
         self.max_results = 8
-        self.timeout = aiohttp.ClientTimeout(total=30)
+        self.timeout = http_client.timeout("searxng")
+        self._refreshing: set[asyncio.Task] = set()
         
     async def search(
         self,
@@ -59,8 +113,13 @@ class WebSearchService:
             if engines:
                 params["engines"] = engines
                 
-            # Fetch search results
-            results = await self._fetch_search_results(params)
+            # Structured results are cached; identical concurrent queries share one request
+            cache_key = "search:" + request_key(
+                q=normalize_query(query), safesearch=safesearch, language=language,
+                categories=categories, time_range=time_range or "all",
+                engines=",".join(sorted(e.strip().lower() for e in engines.split(","))) if engines else None,
+            )
+            results = await self._cached_search(cache_key, params, time_range)
             
             if not results:
                 return "❌ No results found."
@@ -91,85 +150,166 @@ class WebSearchService:
             logger.error(f"Search error: {e}")
             return f"❌ Search error: {str(e)}"
     
-    async def _fetch_search_results(self, params: Dict[str, Any]) -> List[Dict]:
+    async def _cached_search(self, cache_key: str, params: Dict[str, Any],
+                             time_range: Optional[str]) -> List[Dict]:
+        """
+        Results from the cache when possible.
+
+        Fresh entries are returned as is. Stale entries (older than the TTL for
+        time_range, but within SEARCH_STALE_FACTOR TTLs) are returned immediately
+        while a background request refreshes them.
         """
-        Execute HTTP request to SearXNG and retrieve results.
+        entry = search_cache.get(cache_key)
+        if entry:
+            fresh_ttl = SEARCH_CACHE_TTL.get(time_range or "all", SEARCH_CACHE_TTL["all"])
+            if time.time() - entry["fetched_at"] > fresh_ttl:
+                self._revalidate(cache_key, params, time_range)
+            return entry["results"]
+        return await inflight.do(cache_key, lambda: self._refresh(cache_key, params, time_range))
+
+    async def _refresh(self, cache_key: str, params: Dict[str, Any], time_range: Optional[str]) -> List[Dict]:
+        results = await self._fetch_search_results(params)
+        if results:
+            # Empty results are not cached: they are usually a dead instance, not an empty web
+            fresh_ttl = SEARCH_CACHE_TTL.get(time_range or "all", SEARCH_CACHE_TTL["all"])
+            search_cache.set(cache_key, {"results": results, "fetched_at": time.time()},
+                             ttl=fresh_ttl * (1 + SEARCH_STALE_FACTOR))
+        return results
+
+    def _revalidate(self, cache_key: str, params: Dict[str, Any], time_range: Optional[str]):
+        async def refresh():
+            try:
+                await inflight.do(cache_key, lambda: self._refresh(cache_key, params, time_range))
+            except Exception as e:
+                logger.warning(f"Background search refresh failed: {e}")
+
+        task = asyncio.create_task(refresh())
+        self._refreshing.add(task)
+        task.add_done_callback(self._refreshing.discard)
+
+    def _ranked(self) -> List[str]:
+        """Instances from best to worst: healthy ones by score, then ejected ones by recovery time."""
+        stats = {url: _instance_stats(url) for url in self.instances}
+        healthy = sorted((url for url in self.instances if stats[url].available), key=lambda u: stats[u].score())
+        ejected = sorted((url for url in self.instances if not stats[url].available),
+                         key=lambda u: stats[u].ejected_until)
+        return healthy + ejected
+
+    async def _query_instance(self, instance: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        One request to one instance. Updates the scoreboard.
+        Raises on network errors, non-200 responses and invalid JSON.
         """
         headers = {
             "User-Agent": "Mozilla/5.0 (compatible; WebSearchService/1.0)",
             "Accept": "application/json",
         }
-        
-        async with aiohttp.ClientSession(timeout=self.timeout, headers=headers) as session:
-            try:
-                async with session.get(self.search_endpoint, params=params) as response:
-                    if response.status != 200:
-                        logger.error(f"SearXNG returned status {response.status}")
-                        # Try to get error details
-                        try:
-                            error_text = await response.text()
-                            logger.error(f"Error response: {error_text[:200]}")
-                        except:
-                            pass
-                        return []
-                    
-                    data = await response.json()
-                    
-                    # Check for results
-                    if not data.get("results"):
-                        # Check for suggestions
-                        suggestions = data.get("suggestions", [])
-                        if suggestions:
-                            return [{
-                                "title": "Did you mean:",
-                                "content": ", ".join(suggestions[:3]),
-                                "url": "",
-                                "engine": "suggestion"
-                            }]
-                        return []
-                    
-                    # Return only the requested number of results
-                    return data["results"][:self.max_results]
-                    
-            except aiohttp.ClientConnectorError:
-                # Try fallback instances if current is unavailable
-                return await self._try_fallback_search(params)
-            except aiohttp.ServerTimeoutError:
-                logger.error("Search request timed out")
-                return []
-    
-    async def _try_fallback_search(self, params: Dict[str, Any]) -> List[Dict]:
+        stats = _instance_stats(instance)
+        stats.outstanding += 1
+        started = time.monotonic()
+        try:
+            async with http_client.session.get(f"{instance}/search", params=params, headers=headers,
+                                               timeout=self.timeout) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status,
+                        message=error_text[:200]
+                    )
+                data = await response.json(content_type=None)
+        except asyncio.CancelledError:
+            # Lost the race, the instance itself is fine
+            raise
+        except Exception:
+            stats.record_failure()
+            raise
+        finally:
+            stats.outstanding -= 1
+        stats.record_success(time.monotonic() - started)
+        return data
+
+    async def _fetch_search_results(self, params: Dict[str, Any]) -> List[Dict]:
         """
-        Try alternative public SearXNG instances if primary is unavailable.
+        Hedged fan-out across SearXNG instances.
+
+        The best instance on the scoreboard is queried first. If it has not
+        answered within its p90 latency (SEARCH_HEDGE_DELAY without history),
+        the next one is queried too, up to SEARCH_HEDGE_MAX at once; failures
+        move on to the next instance immediately. The first response with
+        results wins and the rest are cancelled.
         """
-        fallback_instances = [
-            "https://searx.be",
-            "https://search.ononoki.org",
-            "https://searx.tuxcloud.net",
-            "https://search.us.projectsegfau.lt"
-        ]
-        
-        for instance in fallback_instances:
-            if instance == self.instance_url:
-                continue
-                
-            try:
-                logger.info(f"Trying fallback instance: {instance}")
-                temp_endpoint = f"{instance}/search"
-                
-                async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                    async with session.get(temp_endpoint, params=params) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            logger.info(f"Successfully used fallback instance: {instance}")
-                            return data.get("results", [])[:self.max_results]
-            except Exception as e:
-                logger.debug(f"Fallback instance {instance} failed: {e}")
-                continue
-                
-        logger.error("All SearXNG instances are unavailable")
+        ranked = self._ranked()
+        tasks: Dict[asyncio.Task, str] = {}
+        winners: List[List[Dict]] = []
+        suggestions: List[str] = []
+
+        def launch() -> bool:
+            if not ranked:
+                return False
+            instance = ranked.pop(0)
+            tasks[asyncio.create_task(self._query_instance(instance, params))] = instance
+            return True
+
+        launch()
+        try:
+            while tasks and not winners:
+                hedge_delay = None
+                if ranked and len(tasks) < SEARCH_HEDGE_MAX:
+                    latest = _instance_stats(list(tasks.values())[-1])
+                    hedge_delay = latest.percentile(0.9) or SEARCH_HEDGE_DELAY
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    logger.info(f"Search hedge: {list(tasks.values())[-1]} slower than {hedge_delay:.2f}s")
+                    launch()
+                    continue
+
+                for task in done:
+                    instance = tasks.pop(task)
+                    error = task.exception()
+                    if error is not None:
+                        logger.warning(f"SearXNG instance {instance} failed: {type(error).__name__}: {error}")
+                        continue
+                    data = task.result()
+                    if data.get("results"):
+                        winners.append(data["results"])
+                    else:
+                        # Empty answer: public instances often have their engines rate-limited
+                        suggestions = suggestions or data.get("suggestions", [])
+
+                if not winners and not tasks:
+                    launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if winners:
+            # Several responses can finish in the same tick — merge them
+            return self._dedupe([result for results in winners for result in results])[:self.max_results]
+        if suggestions:
+            return [{
+                "title": "Did you mean:",
+                "content": ", ".join(suggestions[:3]),
+                "url": "",
+                "engine": "suggestion"
+            }]
+        logger.error("No SearXNG instance returned results")
         return []
-    
+
+    @staticmethod
+    def _dedupe(results: List[Dict]) -> List[Dict]:
+        """Keeps the first result for each canonical URL."""
+        seen = set()
+        unique = []
+        for result in results:
+            url = result.get("url", result.get("href", ""))
+            key = canonical_url(url) if url else id(result)
+            if key in seen:
+                continue
+            seen.add(key)
+            unique.append(result)
+        return unique
+
     def _format_results(self, results: List[Dict]) -> List[str]:
         """
         Format search results into readable format.
@@ -212,14 +352,14 @@ class WebSearchService:
         Get list of available search engines in current instance.
         """
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.get(f"{self.instance_url}/info") as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get("engines", {})
-                    else:
-                        logger.error(f"Failed to fetch engines: HTTP {response.status}")
-                        return {}
+            async with http_client.session.get(f"{self.instance_url}/info",
+                                               timeout=self.timeout) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return data.get("engines", {})
+                else:
+                    logger.error(f"Failed to fetch engines: HTTP {response.status}")
+                    return {}
         except Exception as e:
             logger.error(f"Error fetching engines: {e}")
             return {}
@@ -229,9 +369,9 @@ class WebSearchService:
         Check availability of SearXNG instance.
         """
         try:
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
-                async with session.get(f"{self.instance_url}/", timeout=5) as response:
-                    return response.status == 200
+            async with http_client.session.get(f"{self.instance_url}/",
+                                               timeout=aiohttp.ClientTimeout(total=5)) as response:
+                return response.status == 200
         except Exception as e:
             logger.debug(f"Health check failed: {e}")
             return False
@@ -260,9 +400,6 @@ class WebSearchService:
                     return result
                 
                 logger.info(f"Search attempt {attempt + 1} failed, retrying...")
-                # Try a different instance on retry
-                if attempt == 0:
-                    await self._try_fallback_search({"q": query})
                     
             except Exception as e:
                 if attempt == max_retries:
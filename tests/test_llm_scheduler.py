@@ -0,0 +1,62 @@
+import asyncio
+import os
+
+os.environ.setdefault("DISCORD_TOKEN", "test")
+os.environ.setdefault("PIAPI_KEY", "test")
+
+from services.llm_scheduler import LLMScheduler
+
+
+async def _serve(scheduler: LLMScheduler, requests: list[tuple[str, int, int | None]]) -> list[str]:
+    """Занимает единственный слот, ставит запросы в очередь и возвращает порядок обслуживания."""
+    served = []
+    await scheduler.acquire(0, None)
+
+    async def request(name: str, user_id: int, guild_id: int | None):
+        async with scheduler.slot(user_id, guild_id):
+            served.append(name)
+
+    tasks = []
+    for name, user_id, guild_id in requests:
+        tasks.append(asyncio.create_task(request(name, user_id, guild_id)))
+        await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return served
+
+
+def test_users_sharing_a_guild_alternate():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=10)
+    order = asyncio.run(_serve(scheduler, [("a2", 1, 10), ("a3", 1, 10), ("b1", 2, 10)]))
+    assert order == ["a2", "b1", "a3"]
+
+
+def test_guilds_alternate_before_users():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=10)
+    order = asyncio.run(_serve(scheduler, [
+        ("a1", 1, 10), ("a2", 1, 10), ("b1", 2, 10), ("c1", 3, 20), ("c2", 3, 20),
+    ]))
+    assert order == ["a1", "c1", "b1", "c2", "a2"]
+
+
+def test_user_weight_gives_a_larger_share():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=10, user_weights={1: 2.0})
+    order = asyncio.run(_serve(scheduler, [
+        ("a1", 1, 10), ("a2", 1, 10), ("a3", 1, 10), ("a4", 1, 10), ("b1", 2, 10), ("b2", 2, 10),
+    ]))
+    assert order.index("b2") > order.index("a3")
+    assert order[:3].count("b1") == 1
+
+
+def test_cancelled_request_frees_its_place():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10)
+        await scheduler.acquire(0, None)
+        waiter = asyncio.create_task(scheduler.acquire(1, 10))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        scheduler.release()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return scheduler.active, scheduler.waiting
+
+    assert asyncio.run(scenario()) == (0, 0)
@@ -0,0 +1,41 @@
+from collections import OrderedDict
+from config import ANSWER_INDEX_CHANNELS, ANSWER_INDEX_PER_CHANNEL
+
+
+class AnswerIndex:
+    """
+    Последние ответы бота по каналам: полный текст без обрезки под embed.
+    Ограничен и по числу каналов, и по числу ответов в канале — старое вытесняется.
+    """
+
+    def __init__(self, max_channels: int = ANSWER_INDEX_CHANNELS, per_channel: int = ANSWER_INDEX_PER_CHANNEL):
+        self.max_channels = max_channels
+        self.per_channel = per_channel
+        self.channels: OrderedDict[int, OrderedDict[int, str]] = OrderedDict()
+
+    def record(self, channel_id: int, message_id: int, text: str):
+        answers = self.channels.get(channel_id)
+        if answers is None:
+            answers = self.channels[channel_id] = OrderedDict()
+            if len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+        self.channels.move_to_end(channel_id)
+        answers[message_id] = text
+        answers.move_to_end(message_id)
+        if len(answers) > self.per_channel:
+            answers.popitem(last=False)
+
+    def latest(self, channel_id: int) -> tuple[int, str] | None:
+        """(message_id, текст) последнего ответа в канале или None."""
+        answers = self.channels.get(channel_id)
+        if not answers:
+            return None
+        message_id = next(reversed(answers))
+        return message_id, answers[message_id]
+
+    def get(self, channel_id: int, message_id: int) -> str | None:
+        answers = self.channels.get(channel_id)
+        return answers.get(message_id) if answers else None
+
+
+answer_index = AnswerIndex()
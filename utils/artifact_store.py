@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from config import (GENERATED_IMAGES_DIR, GENERATED_VIDEOS_DIR, TTS_CACHE_DIR,
+                    ARTIFACT_IMAGE_BUDGET_MB, ARTIFACT_VIDEO_BUDGET_MB, ARTIFACT_AUDIO_BUDGET_MB)
+from core.db import connect
+from core.logger import logger
+
+
+def request_key(**params) -> str:
+    """Стабильный ключ запроса: sha256 от нормализованных параметров (не зависит от процесса)."""
+    normalized = {
+        name: " ".join(value.split()) if isinstance(value, str) else value
+        for name, value in params.items()
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+class ArtifactStore:
+    """
+    Хранилище сгенерированных файлов (картинки, видео, аудио) с адресацией по содержимому.
+    Файл называется sha256 своих байт, поэтому одинаковый результат хранится один раз.
+    Индекс (SQLite в той же папке) связывает ключ запроса с файлом.
+    Общий объём ограничен max_bytes — вытесняются давно не использованные файлы.
+    """
+
+    LOW_WATER = 0.9      # при переполнении чистим до этой доли max_bytes, чтобы не вытеснять на каждой записи
+    EVICT_BATCH = 100
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._conn = connect(os.path.join(root, "index.db"))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            " sha TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS requests ("
+            " key TEXT PRIMARY KEY, sha TEXT NOT NULL REFERENCES blobs(sha))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs(last_access)")
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def _get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT b.sha, b.path FROM requests r JOIN blobs b ON b.sha = r.sha WHERE r.key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            sha, path = row
+            if not os.path.exists(path):
+                # Файл удалили вручную — забываем запись
+                self._forget_blob(sha)
+                return None
+            self._conn.execute("UPDATE blobs SET last_access = ? WHERE sha = ?", (time.time(), sha))
+            return path
+
+    def _put(self, key: str, data: bytes | None, src_path: str | None, ext: str) -> str:
+        if data is None:
+            with open(src_path, "rb") as f:
+                digest = hashlib.sha256()
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            sha = digest.hexdigest()
+        else:
+            sha = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.root, f"{sha}{ext}")
+
+        with self._lock:
+            known = self._conn.execute("SELECT size FROM blobs WHERE sha = ?", (sha,)).fetchone()
+            if known and os.path.exists(path):
+                if src_path:
+                    os.remove(src_path)
+            else:
+                if known:
+                    self._total -= known[0]
+                if src_path:
+                    os.replace(src_path, path)
+                else:
+                    with open(path, "wb") as f:
+                        f.write(data)
+                size = os.path.getsize(path)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO blobs (sha, path, size, last_access) VALUES (?, ?, ?, ?)",
+                    (sha, path, size, time.time())
+                )
+                self._total += size
+            self._conn.execute("INSERT OR REPLACE INTO requests (key, sha) VALUES (?, ?)", (key, sha))
+            self._conn.execute("UPDATE blobs SET last_access = ? WHERE sha = ?", (time.time(), sha))
+            if self._total > self.max_bytes:
+                self._evict(keep=sha)
+        return path
+
+    def _forget_blob(self, sha: str):
+        row = self._conn.execute("SELECT path, size FROM blobs WHERE sha = ?", (sha,)).fetchone()
+        if row is None:
+            return
+        path, size = row
+        self._conn.execute("DELETE FROM requests WHERE sha = ?", (sha,))
+        self._conn.execute("DELETE FROM blobs WHERE sha = ?", (sha,))
+        self._total -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep: str):
+        target = self.max_bytes * self.LOW_WATER
+        evicted = 0
+        while self._total > target:
+            rows = self._conn.execute(
+                "SELECT sha FROM blobs WHERE sha != ? ORDER BY last_access LIMIT ?", (keep, self.EVICT_BATCH)
+            ).fetchall()
+            if not rows:
+                break
+            for sha, in rows:
+                if self._total <= target:
+                    break
+                self._forget_blob(sha)
+                evicted += 1
+        if evicted:
+            logger.info(f"Artifact store {self.root}: evicted {evicted} files")
+
+    async def get(self, key: str) -> str | None:
+        """Путь к файлу для ключа запроса или None."""
+        try:
+            return await asyncio.to_thread(self._get, key)
+        except Exception as e:
+            logger.error(f"Artifact store read error: {e}")
+            return None
+
+    async def put_bytes(self, key: str, data: bytes, ext: str) -> str:
+        """Сохраняет байты (запись в рабочем потоке) и возвращает путь."""
+        return await asyncio.to_thread(self._put, key, data, None, ext)
+
+    async def put_file(self, key: str, src_path: str, ext: str) -> str:
+        """Переносит готовый файл в хранилище (исходник перемещается или удаляется как дубль)."""
+        return await asyncio.to_thread(self._put, key, None, src_path, ext)
+
+
+image_store = ArtifactStore(GENERATED_IMAGES_DIR, int(ARTIFACT_IMAGE_BUDGET_MB * 1024 * 1024))
+video_store = ArtifactStore(GENERATED_VIDEOS_DIR, int(ARTIFACT_VIDEO_BUDGET_MB * 1024 * 1024))
+audio_store = ArtifactStore(TTS_CACHE_DIR, int(ARTIFACT_AUDIO_BUDGET_MB * 1024 * 1024))
@@ -1,26 +1,163 @@
+import pickle
+import threading
+import time
+import zlib
 from collections import OrderedDict
+from config import CACHE_BUDGETS_MB, CACHE_COMPRESS_MIN_BYTES, CACHE_NEGATIVE_TTL
 
-class SimpleCache:
-    def __init__(self, max_size: int = 50):
-        self.cache = OrderedDict()
-        self.max_size = max_size
 
-    def get(self, key):
-        if key in self.cache:
-            self.cache.move_to_end(key)
-            return self.cache[key]
-        return None
+class _Negative:
+    """Метка «запрос уже падал»: ложна в булевом контексте, как промах."""
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "NEGATIVE"
+
+
+NEGATIVE = _Negative()
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "compressed")
+
+    def __init__(self, value, size: int, expires_at: float | None, compressed: bool):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.compressed = compressed
+
+
+class Cache:
+    """
+    LRU-кэш в памяти с бюджетом в байтах и TTL на каждую запись.
+    Длинные строки хранятся сжатыми (zlib), неудачи можно закэшировать
+    через set_negative — тогда get вернёт NEGATIVE.
+    Методы не содержат await, поэтому безопасны для корутин; замок — для вызовов из потоков.
+    """
+
+    def __init__(self, name: str, max_bytes: int, default_ttl: float | None = None,
+                 compress_min_bytes: int = CACHE_COMPRESS_MIN_BYTES):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.compress_min_bytes = compress_min_bytes
+        self.cache: OrderedDict[str, _Entry] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    @staticmethod
+    def _sizeof(value) -> int:
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+        if isinstance(value, str):
+            return len(value.encode())
+        try:
+            return len(pickle.dumps(value))
+        except Exception:
+            return 64
+
+    def _drop(self, key: str):
+        entry = self.cache.pop(key)
+        self.bytes -= entry.size
 
-    def set(self, key, value):
-        if key in self.cache:
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
             self.cache.move_to_end(key)
-        self.cache[key] = value
-        if len(self.cache) > self.max_size:
-            self.cache.popitem(last=False)
+            if entry.value is NEGATIVE:
+                self.negative_hits += 1
+                return NEGATIVE
+            self.hits += 1
+            if entry.compressed:
+                return zlib.decompress(entry.value).decode()
+            return entry.value
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        compressed = False
+        if isinstance(value, str) and len(value) >= self.compress_min_bytes:
+            packed = zlib.compress(value.encode(), 6)
+            if len(packed) < len(value):
+                value, compressed = packed, True
+        size = self._sizeof(value) + len(str(key))
+        if size > self.max_bytes:
+            self.delete(key)
+            return
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            if key in self.cache:
+                self._drop(key)
+            self.cache[key] = _Entry(value, size, expires_at, compressed)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old_key = next(iter(self.cache))
+                self._drop(old_key)
+                self.evictions += 1
+
+    def set_negative(self, key, ttl: float = CACHE_NEGATIVE_TTL):
+        """Запоминает неудачу на ttl секунд, чтобы не долбить упавший API повторами."""
+        with self._lock:
+            if key in self.cache:
+                self._drop(key)
+            self.cache[key] = _Entry(NEGATIVE, len(str(key)), time.monotonic() + ttl, False)
+            self.bytes += len(str(key))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self.cache:
+                self._drop(key)
 
     def clear(self):
-        self.cache.clear()
+        with self._lock:
+            self.cache.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.negative_hits
+        return {
+            "name": self.name,
+            "entries": len(self.cache),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+_registry: list[Cache] = []
+
+
+def all_cache_stats() -> list[dict]:
+    return [cache.stats() for cache in _registry]
+
+
+def _budget(name: str) -> int:
+    return int(CACHE_BUDGETS_MB.get(name, 8) * 1024 * 1024)
+
 
-response_cache = SimpleCache()
-tts_cache = SimpleCache()
-image_cache = SimpleCache()
\ No newline at end of file
+response_cache = Cache("llm", _budget("llm"))
+tts_cache = Cache("tts", _budget("tts"))
+image_cache = Cache("image", _budget("image"))
+video_cache = Cache("video", _budget("video"))
+search_cache = Cache("search", _budget("search"))
@@ -0,0 +1,62 @@
+import time
+from collections import deque
+
+
+class EndpointStats:
+    """
+    Здоровье одного бэкенда: EWMA задержки, доля успехов, число запросов в работе
+    и автомат-предохранитель (circuit breaker).
+    После eject_after ошибок подряд бэкенд выключается на eject_base секунд,
+    при повторных сбоях — вдвое дольше (но не больше eject_max).
+    Когда время вышло, бэкенд снова пробуется (half-open); первый успех его возвращает.
+    """
+
+    def __init__(self, name: str, alpha: float = 0.3, eject_after: int = 1,
+                 eject_base: float = 10.0, eject_max: float = 300.0):
+        self.name = name
+        self.alpha = alpha
+        self.eject_after = eject_after
+        self.eject_base = eject_base
+        self.eject_max = eject_max
+        self.latency: float | None = None     # EWMA, секунд
+        self.success_rate = 1.0               # EWMA от 0 до 1
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.samples: deque[float] = deque(maxlen=100)
+
+    @property
+    def state(self) -> str:
+        if self.ejected_until > time.monotonic():
+            return "open"
+        return "half-open" if self.consecutive_failures >= self.eject_after else "closed"
+
+    @property
+    def available(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self, latency: float):
+        self.samples.append(latency)
+        self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+        self.success_rate = self.alpha + (1 - self.alpha) * self.success_rate
+        self.consecutive_failures = 0
+        self.ejections = 0
+
+    def record_failure(self):
+        self.success_rate = (1 - self.alpha) * self.success_rate
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.eject_after:
+            self.ejected_until = time.monotonic() + min(self.eject_max, self.eject_base * 2 ** self.ejections)
+            self.ejections += 1
+
+    def percentile(self, q: float, min_samples: int = 10) -> float | None:
+        if len(self.samples) < min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def score(self, default_latency: float = 1.0) -> float:
+        """Чем меньше, тем лучше: ожидаемая задержка с учётом очереди и надёжности."""
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (self.outstanding + 1) / max(self.success_rate, 0.05)
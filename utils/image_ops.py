@@ -0,0 +1,77 @@
+"""
+Тяжёлые операции с картинками для пула процессов.
+Функции выполняются в рабочих процессах пула (форки бота), поэтому модуль не зависит
+от config и логгера: всё нужное приходит аргументами, ошибки — исключениями.
+"""
+import io
+import math
+import os
+from PIL import Image
+
+_FORMATS = {"webp": ("WEBP", ".webp"), "jpeg": ("JPEG", ".jpg")}
+_MIN_SIDE = 256
+
+
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "WEBP":
+        image.save(buffer, format=fmt, quality=quality, method=4)
+    else:
+        image.save(buffer, format=fmt, quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def _open(source: str | bytes) -> Image.Image:
+    """Картинка из файла или из байт в памяти."""
+    return Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def encode_for_upload(source: str | bytes, fmt: str, quality: int, max_bytes: int) -> tuple[bytes, str] | None:
+    """
+    Пережимает картинку в WebP/JPEG так, чтобы она влезла в max_bytes:
+    сначала снижается качество, потом уменьшается размер.
+    fmt="png" — оставить оригинал без потерь; None означает «оригинал влезает, отправляй как есть».
+    ValueError — не влезает даже после уменьшения до _MIN_SIDE.
+    """
+    if fmt == "png":
+        size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+        if size <= max_bytes:
+            return None
+        fmt = "webp"  # оригинал не влезает в лимит — без потерь не обойтись
+    pil_format, ext = _FORMATS.get(fmt, _FORMATS["webp"])
+
+    with _open(source) as original:
+        image = original.convert("RGB")
+    while True:
+        for step in (0, 15, 30):
+            data = _encode(image, pil_format, max(30, quality - step))
+            if len(data) <= max_bytes:
+                return data, ext
+        if min(image.size) <= _MIN_SIDE:
+            raise ValueError(f"картинка не влезает в {max_bytes} байт даже при {image.width}x{image.height}")
+        image = image.resize((image.width * 3 // 4, image.height * 3 // 4), Image.LANCZOS)
+
+
+def thumbnail(source: str | bytes, tile: int) -> bytes:
+    """JPEG-превью одной картинки, вписанное в квадрат tile x tile."""
+    with _open(source) as image:
+        image.draft("RGB", (tile, tile))
+        thumb = image.convert("RGB")
+    thumb.thumbnail((tile, tile), Image.LANCZOS)
+    return _encode(thumb, "JPEG", 85)
+
+
+def grid(sources: list[str | bytes], tile: int) -> bytes:
+    """JPEG-сетка из уменьшенных копий картинок."""
+    columns = math.ceil(math.sqrt(len(sources)))
+    rows = math.ceil(len(sources) / columns)
+    canvas = Image.new("RGB", (columns * tile, rows * tile), (32, 34, 37))
+    for index, source in enumerate(sources):
+        with _open(source) as image:
+            image.draft("RGB", (tile, tile))
+            thumb = image.convert("RGB")
+        thumb.thumbnail((tile, tile), Image.LANCZOS)
+        x = (index % columns) * tile + (tile - thumb.width) // 2
+        y = (index // columns) * tile + (tile - thumb.height) // 2
+        canvas.paste(thumb, (x, y))
+    return _encode(canvas, "JPEG", 85)
@@ -0,0 +1,72 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import IMAGE_POOL_WORKERS, IMAGE_UPLOAD_FORMAT, IMAGE_UPLOAD_QUALITY, IMAGE_GRID_TILE
+from core.logger import logger
+
+try:
+    from utils import image_ops
+except ImportError:  # Pillow необязателен: без него картинки уходят как есть и без сетки
+    image_ops = None
+    logger.warning("Pillow не установлен — пережатие и сетка превью отключены. Установи: pip install Pillow")
+
+
+class ImagePool:
+    """
+    Пул процессов для обработки картинок: пережатие под лимит загрузки и сетка превью.
+    Event loop не блокируется на CPU-работе. Пул создаётся при первом использовании.
+    Рабочие процессы — явно fork: main.py запускает бота без проверки __main__,
+    и spawn/forkserver выполнили бы его заново в каждом процессе.
+    """
+
+    def __init__(self, workers: int = IMAGE_POOL_WORKERS):
+        self.workers = workers
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def available(self) -> bool:
+        return image_ops is not None
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("fork"))
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def prepare_upload(self, source: str | bytes, max_bytes: int, fmt: str = IMAGE_UPLOAD_FORMAT,
+                             quality: int = IMAGE_UPLOAD_QUALITY) -> tuple[bytes, str] | None:
+        """
+        (байты, расширение) пережатой картинки (путь или байты PNG), которая влезает в max_bytes.
+        None — пережать не удалось или не нужно (оригинал без потерь, Pillow нет, ошибка):
+        вызывающий сам проверяет, влезает ли исходный файл.
+        """
+        if not self.available:
+            return None
+        try:
+            return await self._run(image_ops.encode_for_upload, source, fmt, quality, max_bytes)
+        except Exception as e:
+            logger.error(f"Image recompression error: {e}")
+            return None
+
+    async def make_preview(self, sources: list[str | bytes], tile: int = IMAGE_GRID_TILE) -> bytes | None:
+        """
+        Лёгкое JPEG-превью для embed: уменьшенная копия одной картинки или сетка из нескольких.
+        None, если Pillow нет или картинок нет.
+        """
+        if not self.available or not sources:
+            return None
+        try:
+            if len(sources) == 1:
+                return await self._run(image_ops.thumbnail, sources[0], tile)
+            return await self._run(image_ops.grid, sources, tile)
+        except Exception as e:
+            logger.error(f"Image preview error: {e}")
+            return None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_pool = ImagePool()
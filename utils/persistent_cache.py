@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+from config import LLM_CACHE_DB, LLM_CACHE_MAX_MB
+from core.db import connect
+from core.logger import logger
+
+
+class PersistentCache:
+    """
+    Дисковый кэш (SQLite) для текстовых значений.
+    Переживает рестарты, у каждой записи свой TTL, общий объём ограничен
+    max_bytes — при переполнении вытесняются давно не читанные записи.
+    Все обращения к базе идут через asyncio.to_thread.
+    Рядом с записью можно сохранить SimHash-отпечаток промпта — по ним
+    после рестарта восстанавливается индекс похожих вопросов.
+    """
+
+    LOW_WATER = 0.9      # при переполнении чистим до этой доли max_bytes, чтобы не вытеснять на каждой записи
+    EVICT_BATCH = 200
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache(last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache(expires_at)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            " key TEXT PRIMARY KEY, namespace TEXT NOT NULL, fingerprint TEXT NOT NULL)"
+        )
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def _get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, size, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, size, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.execute("DELETE FROM fingerprints WHERE key = ?", (key,))
+                self._total -= size
+                return None
+            self._conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+            return value
+
+    def _set(self, key: str, value: str, ttl: float, fingerprint: tuple[str, int] | None):
+        now = time.time()
+        size = len(value.encode())
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + ttl, now)
+            )
+            if fingerprint is not None:
+                namespace, simhash = fingerprint
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO fingerprints (key, namespace, fingerprint) VALUES (?, ?, ?)",
+                    (key, namespace, f"{simhash:016x}")  # 64 бита без знака не влезают в INTEGER SQLite
+                )
+            self._total += size - (old[0] if old else 0)
+            if self._total > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        # Сначала протухшие, потом самые давно читанные
+        expired = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache WHERE expires_at <= ?", (now,)
+        ).fetchone()[0]
+        self._conn.execute(
+            "DELETE FROM fingerprints WHERE key IN (SELECT key FROM cache WHERE expires_at <= ?)", (now,)
+        )
+        self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        self._total -= expired
+
+        target = self.max_bytes * self.LOW_WATER
+        evicted = 0
+        while self._total > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM cache ORDER BY last_access LIMIT ?", (self.EVICT_BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            victims = []
+            for key, size in rows:
+                if self._total <= target:
+                    break
+                victims.append((key,))
+                self._total -= size
+            self._conn.executemany("DELETE FROM cache WHERE key = ?", victims)
+            self._conn.executemany("DELETE FROM fingerprints WHERE key = ?", victims)
+            evicted += len(victims)
+        if evicted:
+            logger.debug(f"Persistent cache {self.path}: evicted {evicted} entries")
+
+    async def get(self, key: str) -> str | None:
+        try:
+            return await asyncio.to_thread(self._get, key)
+        except Exception as e:
+            logger.error(f"Persistent cache read error: {e}")
+            return None
+
+    async def set(self, key: str, value: str, ttl: float, fingerprint: tuple[str, int] | None = None):
+        """fingerprint — (пространство, SimHash промпта) для восстановления индекса похожих вопросов."""
+        try:
+            await asyncio.to_thread(self._set, key, value, ttl, fingerprint)
+        except Exception as e:
+            logger.error(f"Persistent cache write error: {e}")
+
+    def _fingerprints(self, limit: int) -> list[tuple[str, str, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT f.namespace, f.key, f.fingerprint, c.last_access FROM fingerprints f"
+                " JOIN cache c ON c.key = f.key WHERE c.expires_at > ? ORDER BY c.last_access DESC LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+        return [(namespace, key, int(fingerprint, 16)) for namespace, key, fingerprint, _ in reversed(rows)]
+
+    async def fingerprints(self, limit: int) -> list[tuple[str, str, int]]:
+        """Отпечатки живых записей: (пространство, ключ, SimHash), не больше limit самых свежих, от старых к свежим."""
+        try:
+            return await asyncio.to_thread(self._fingerprints, limit)
+        except Exception as e:
+            logger.error(f"Persistent cache read error: {e}")
+            return []
+
+
+llm_disk_cache = PersistentCache(LLM_CACHE_DB, int(LLM_CACHE_MAX_MB * 1024 * 1024))
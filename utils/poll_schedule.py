@@ -0,0 +1,42 @@
+import random
+import statistics
+from collections import defaultdict, deque
+
+
+class CompletionStats:
+    """
+    Сколько обычно длятся задачи (по ключу, например длина и формат видео).
+    Нужна, чтобы не дёргать API статуса, пока задача заведомо не готова.
+    """
+
+    def __init__(self, default: float, maxlen: int = 50):
+        self.default = default
+        self._durations: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=maxlen))
+
+    def record(self, key: str, seconds: float):
+        self._durations[key].append(seconds)
+
+    def expected(self, key: str) -> float:
+        durations = self._durations.get(key)
+        return statistics.median(durations) if durations else self.default
+
+    def earliest(self, key: str) -> float:
+        """Раньше этого задача почти никогда не готова: 20-й перцентиль истории (или половина минимума)."""
+        durations = sorted(self._durations.get(key) or ())
+        if len(durations) < 5:
+            return (durations[0] if durations else self.default) * 0.5
+        return durations[len(durations) // 5]
+
+
+def poll_delays(first: float, minimum: float, maximum: float, factor: float = 1.6, jitter: float = 0.2):
+    """
+    Паузы между проверками статуса: первая — около first (задача вряд ли готова раньше),
+    дальше экспоненциально от minimum до maximum. Каждая пауза со случайным разбросом ±jitter,
+    чтобы одновременные задачи не опрашивали API синхронно.
+    """
+    delay = max(first, minimum)
+    yield delay * random.uniform(1 - jitter, 1 + jitter)
+    delay = minimum
+    while True:
+        yield delay * random.uniform(1 - jitter, 1 + jitter)
+        delay = min(maximum, delay * factor)
@@ -0,0 +1,149 @@
+import hashlib
+import re
+import unicodedata
+from collections import OrderedDict
+from config import LLM_NEAR_DUP_MAX_ENTRIES
+
+_WORD_RE = re.compile(r"\w+")
+_TRAILING_PUNCT = ".!?…"
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Точный ключ кэша: регистр, пробелы, Unicode-формы и знаки в конце предложения не влияют на результат.
+    Остальные символы сохраняются — "2+2" и "2*2", "C++" и "C#" остаются разными вопросами.
+    """
+    text = " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+    return text.rstrip(_TRAILING_PUNCT).rstrip()
+
+
+def _tokens(normalized: str) -> list[str]:
+    # Для SimHash символы отбрасываются: похожесть считается только по словам
+    return _WORD_RE.findall(normalized)
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+
+
+def simhash(normalized: str) -> int:
+    """64-битный SimHash по словам и парам слов."""
+    tokens = _tokens(normalized)
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    # Считаем единицы по столбцам битовых строк — так заметно быстрее цикла по битам
+    rows = [format(_feature_hash(feature), "064b") for feature in features]
+    half = len(rows) / 2
+    fingerprint = 0
+    for position, column in enumerate(zip(*rows)):
+        if column.count("1") > half:
+            fingerprint |= 1 << (63 - position)
+    return fingerprint
+
+
+class SimHashIndex:
+    """
+    Индекс отпечатков для поиска похожих промптов.
+    Отпечаток делится на 8 полос по 8 бит: если расстояние Хэмминга < 8,
+    хотя бы одна полоса совпадает точно — кандидатов ищем только по ней.
+    """
+
+    BANDS = 8
+    BAND_BITS = 8
+
+    def __init__(self, max_entries: int = LLM_NEAR_DUP_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[int, str] = OrderedDict()   # отпечаток -> ключ кэша
+        self.buckets: list[dict[int, set[int]]] = [{} for _ in range(self.BANDS)]
+
+    def _bands(self, fingerprint: int):
+        mask = (1 << self.BAND_BITS) - 1
+        for i in range(self.BANDS):
+            yield i, (fingerprint >> (i * self.BAND_BITS)) & mask
+
+    def add(self, fingerprint: int, cache_key: str):
+        if fingerprint in self.entries:
+            self.entries.move_to_end(fingerprint)
+            self.entries[fingerprint] = cache_key
+            return
+        self.entries[fingerprint] = cache_key
+        for i, band in self._bands(fingerprint):
+            self.buckets[i].setdefault(band, set()).add(fingerprint)
+        if len(self.entries) > self.max_entries:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, fingerprint: int):
+        if self.entries.pop(fingerprint, None) is None:
+            return
+        for i, band in self._bands(fingerprint):
+            bucket = self.buckets[i].get(band)
+            if bucket:
+                bucket.discard(fingerprint)
+                if not bucket:
+                    del self.buckets[i][band]
+
+    def nearest(self, fingerprint: int, max_distance: int) -> str | None:
+        best_key, best_distance = None, max_distance + 1
+        seen = set()
+        for i, band in self._bands(fingerprint):
+            for candidate in self.buckets[i].get(band, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = (candidate ^ fingerprint).bit_count()
+                if distance < best_distance:
+                    best_key, best_distance = self.entries[candidate], distance
+        return best_key
+
+
+class PromptIndex:
+    """
+    Индексы похожих промптов по пространствам (режим + область кэша) и статистика попаданий.
+    Общее число отпечатков по всем пространствам ограничено max_entries — вытесняются самые давние.
+    Отпечатки хранятся и в дисковом кэше, после рестарта индекс восстанавливается через load.
+    """
+
+    MIN_TOKENS = 3   # на совсем коротких промптах SimHash слишком шумный
+
+    def __init__(self, max_entries: int = LLM_NEAR_DUP_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.indexes: dict[str, SimHashIndex] = {}
+        self._order: OrderedDict[tuple[str, int], None] = OrderedDict()
+        self.stats = {"lookups": 0, "near_hits": 0}
+
+    def _insert(self, namespace: str, fingerprint: int, cache_key: str):
+        self.indexes.setdefault(namespace, SimHashIndex(self.max_entries)).add(fingerprint, cache_key)
+        self._order[(namespace, fingerprint)] = None
+        self._order.move_to_end((namespace, fingerprint))
+        while len(self._order) > self.max_entries:
+            (old_namespace, old), _ = self._order.popitem(last=False)
+            index = self.indexes[old_namespace]
+            index.remove(old)
+            if not index.entries:
+                del self.indexes[old_namespace]
+
+    def add(self, namespace: str, normalized: str, cache_key: str) -> int | None:
+        """Добавляет промпт в индекс. Возвращает отпечаток (для дискового кэша) или None."""
+        if len(_tokens(normalized)) < self.MIN_TOKENS:
+            return None
+        fingerprint = simhash(normalized)
+        self._insert(namespace, fingerprint, cache_key)
+        return fingerprint
+
+    def load(self, rows: list[tuple[str, str, int]]):
+        """Восстановление из дискового кэша: (namespace, ключ кэша, отпечаток), от старых к свежим."""
+        for namespace, cache_key, fingerprint in rows:
+            self._insert(namespace, fingerprint, cache_key)
+
+    def find(self, namespace: str, normalized: str, max_distance: int) -> str | None:
+        """Ключ кэша похожего промпта или None."""
+        index = self.indexes.get(namespace)
+        if index is None or max_distance <= 0 or len(_tokens(normalized)) < self.MIN_TOKENS:
+            return None
+        self.stats["lookups"] += 1
+        key = index.nearest(simhash(normalized), min(max_distance, SimHashIndex.BANDS - 1))
+        if key:
+            self.stats["near_hits"] += 1
+        return key
+
+
+prompt_index = PromptIndex()
@@ -0,0 +1,55 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+from core.logger import logger
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых запросов, которые выполняются одновременно.
+    Первый вызов с ключом запускает работу, остальные ждут тот же результат.
+    Ошибка пробрасывается всем ожидающим. Если все ожидающие отменены,
+    отменяется и сама работа.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, _Call] = {}
+        self.coalesced = 0
+
+    def _forget(self, key: str, call: _Call, task: asyncio.Task):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Забираем исключение, даже если его уже некому получить
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None or call.task.cancelled() or call.task.cancelling():
+            call = _Call(asyncio.create_task(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda t, k=key, c=call: self._forget(k, c, t))
+        else:
+            self.coalesced += 1
+            logger.info(f"Coalesced in-flight request: {key[:60]}")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+
+inflight = SingleFlight()
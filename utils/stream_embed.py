@@ -0,0 +1,83 @@
+import asyncio
+import time
+import discord
+from config import STREAM_EDIT_INTERVAL
+from core.logger import logger
+
+
+class StreamingEmbed:
+    """
+    Embed-ответ, который дописывается по мере генерации.
+    Частые обновления склеиваются: сообщение редактируется не чаще,
+    чем раз в STREAM_EDIT_INTERVAL секунд (лимиты Discord на edit).
+    """
+
+    CURSOR = " ▌"
+
+    def __init__(self, interaction: discord.Interaction, title: str, color: int,
+                 footer: str | None = None, interval: float = STREAM_EDIT_INTERVAL,
+                 message: discord.WebhookMessage | None = None):
+        self.interaction = interaction
+        self.title = title
+        self.color = color
+        self.footer = footer
+        self.interval = interval
+        self.message = message  # уже отправленное сообщение-статус, если есть
+        self._text = ""
+        self._last_edit = 0.0
+        self._flush_task: asyncio.Task | None = None
+        self._flushing = False  # отложенная правка уже отправляется, отменять её нельзя
+        self._lock = asyncio.Lock()
+
+    def _build(self, text: str) -> discord.Embed:
+        embed = discord.Embed(title=self.title, description=text[:4096], color=self.color)
+        if self.footer:
+            embed.set_footer(text=self.footer)
+        return embed
+
+    async def _push(self, text: str):
+        async with self._lock:
+            embed = self._build(text)
+            if self.message is None:
+                self.message = await self.interaction.followup.send(embed=embed, wait=True)
+            else:
+                await self.message.edit(embed=embed)
+            self._last_edit = time.monotonic()
+
+    async def _delayed_flush(self, delay: float):
+        await asyncio.sleep(delay)
+        self._flushing = True
+        try:
+            await self._push(self._text[:4096 - len(self.CURSOR)] + self.CURSOR)
+        except discord.HTTPException as e:
+            logger.warning(f"Stream embed edit failed: {e}")
+        finally:
+            self._flushing = False
+
+    async def update(self, text: str):
+        """Запоминает свежий текст; правка уйдёт не раньше, чем позволит интервал."""
+        self._text = text
+        if self._flush_task is None or self._flush_task.done():
+            delay = max(0.0, self.interval - (time.monotonic() - self._last_edit))
+            self._flush_task = asyncio.create_task(self._delayed_flush(delay))
+
+    async def stop(self):
+        """
+        Отменяет отложенную правку: дальше сообщением распоряжается вызывающий.
+        Если правка уже отправляется, дожидается её — иначе первый followup
+        ушёл бы дважды, а поздняя правка с курсором затёрла бы финальную.
+        """
+        task = self._flush_task
+        if task is None or task.done():
+            return
+        if self._flushing:
+            await task
+        else:
+            task.cancel()
+
+    async def finish(self, text: str) -> discord.WebhookMessage:
+        """Финальная правка с полным текстом (без курсора). Возвращает отправленное сообщение."""
+        await self.stop()
+        self._text = text
+        await self._push(text)
+        return self.message
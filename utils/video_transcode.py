@@ -0,0 +1,113 @@
+import asyncio
+import os
+import shutil
+import uuid
+from config import GENERATED_VIDEOS_DIR, FFMPEG_PATH, FFPROBE_PATH, FFMPEG_AUDIO_KBPS, FFMPEG_TIMEOUT
+from utils.artifact_store import video_store, request_key
+from utils.singleflight import inflight
+from core.logger import logger
+
+# Запас на контейнер mp4 и неточность rate control
+_HEADROOM = 0.92
+# Ниже этого битрейта (kbps) кадр уменьшается: лучше меньше пикселей, чем каша из блоков
+_HEIGHTS = ((2500, None), (1200, 720), (600, 480), (0, 360))
+
+_slots = asyncio.Semaphore(1)   # ffmpeg грузит все ядра — пережимаем по одному ролику
+
+
+async def _run(*args: str) -> tuple[int, bytes, bytes]:
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), FFMPEG_TIMEOUT)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        proc.kill()
+        await proc.wait()
+        raise
+    return proc.returncode, stdout, stderr
+
+
+async def duration(path: str) -> float | None:
+    """Длительность ролика в секундах по ffprobe."""
+    code, stdout, _ = await _run(FFPROBE_PATH, "-v", "error", "-show_entries", "format=duration",
+                                 "-of", "default=noprint_wrappers=1:nokey=1", path)
+    try:
+        return float(stdout.strip()) if code == 0 else None
+    except ValueError:
+        return None
+
+
+def _height(video_kbps: float) -> int | None:
+    for min_kbps, height in _HEIGHTS:
+        if video_kbps >= min_kbps:
+            return height
+    return _HEIGHTS[-1][1]
+
+
+async def _transcode(path: str, max_bytes: int) -> str | None:
+    seconds = await duration(path)
+    if not seconds:
+        logger.error(f"ffprobe could not read duration of {path}")
+        return None
+
+    out = os.path.join(GENERATED_VIDEOS_DIR, f"fit_{uuid.uuid4().hex[:8]}.mp4")
+    budget = max_bytes * _HEADROOM
+    result = None
+    try:
+        for attempt in range(3):
+            total_kbps = budget * 8 / seconds / 1000
+            audio_kbps = min(FFMPEG_AUDIO_KBPS, total_kbps * 0.1)
+            video_kbps = int(total_kbps - audio_kbps)
+            height = _height(video_kbps)
+            scale = ["-vf", f"scale=-2:'min(ih,{height})'"] if height else []
+            code, _, stderr = await _run(
+                FFMPEG_PATH, "-y", "-v", "error", "-i", path, *scale,
+                "-c:v", "libx264", "-preset", "veryfast",
+                "-b:v", f"{video_kbps}k", "-maxrate", f"{video_kbps}k", "-bufsize", f"{video_kbps * 2}k",
+                "-c:a", "aac", "-b:a", f"{int(audio_kbps)}k", "-movflags", "+faststart", out
+            )
+            if code != 0:
+                logger.error(f"ffmpeg failed: {stderr.decode(errors='replace')[-500:]}")
+                break
+            size = os.path.getsize(out)
+            logger.info(f"Video transcoded: {os.path.getsize(path)} -> {size} bytes "
+                        f"({video_kbps} kbps, height {height or 'original'}, attempt {attempt + 1})")
+            if size <= max_bytes:
+                result = out
+                break
+            budget *= max_bytes / size * 0.95   # не влезло — сжимаем сильнее пропорционально промаху
+    finally:
+        if result is None and os.path.exists(out):
+            os.remove(out)
+    return result
+
+
+async def fit_video(path: str, max_bytes: int) -> str | None:
+    """
+    Путь к ролику, который влезает в max_bytes: сам файл, если он уже помещается,
+    или его копия, пережатая ffmpeg с битрейтом под длительность (при нехватке — и с уменьшением кадра).
+    Пережатые копии хранятся в video_store. None — если уложиться не получилось или ffmpeg недоступен.
+    """
+    if os.path.getsize(path) <= max_bytes:
+        return path
+    if not shutil.which(FFMPEG_PATH) or not shutil.which(FFPROBE_PATH):
+        logger.warning("ffmpeg/ffprobe not found, oversized video cannot be transcoded")
+        return None
+
+    # Файлы в хранилище названы по sha256 содержимого, так что имя — ключ исходника
+    key = request_key(kind="fit", source=os.path.basename(path), max_bytes=max_bytes)
+    cached = await video_store.get(key)
+    if cached:
+        return cached
+
+    async def transcode():
+        async with _slots:
+            out = await _transcode(path, max_bytes)
+        return await video_store.put_file(key, out, ".mp4") if out else None
+
+    try:
+        return await inflight.do(f"fit:{key}", transcode)
+    except (OSError, asyncio.TimeoutError) as e:
+        logger.error(f"Video transcode error: {e}")
+        return None